@@ -1,178 +1,126 @@
 import hashlib
-import random
+import operator
+import struct
+from spear_core import engine, profiling, rand
 
 def random_bytes():
-    return random.randbytes(32)
+    return rand.random_bytes(32)
+
+class HTLC(engine.WireRecord):
+    __slots__ = ('amount', 'payment_hash', 'set_id')
+
+    # wire format: amount (f64) || payment hash (32 bytes) || set id (32 bytes)
+    wire_format = struct.Struct('<d32s32s')
 
-class HTLC:
     def __init__(self, amount, payment_hash, set_id):
         self.amount = amount
         self.payment_hash = payment_hash
         self.set_id = set_id
 
     def verify(self, preimage):
-        return self.payment_hash == hashlib.sha256(preimage).hexdigest()
+        return self.payment_hash == hashlib.sha256(preimage).digest()
+
+class Preimage(engine.Record):
+    __slots__ = ('amount', 'preimage', 'set_id')
 
-class Preimage:
     def __init__(self, amount, preimage, set_id):
         self.amount = amount
         self.preimage = preimage
         self.set_id = set_id
 
     def payment_hash(self):
-        return hashlib.sha256(self.preimage).hexdigest()
+        return hashlib.sha256(self.preimage).digest()
 
-class Payment:
+class Payment(engine.HashLockPayment):
     def __init__(self, payment_hash, amount, parts_count, redundant_parts_count):
-        self.payment_hash = payment_hash
+        # parts are tied together by set id, every part has its own payment hash
         self.set_id = random_bytes()
-        self.amount = amount
-        self.amount_per_part = amount / parts_count
-        self.locked_amount = amount + self.amount_per_part * redundant_parts_count
-        self.parts_count = parts_count
-        self.redundant_parts_count = redundant_parts_count
-        self.preimages = []
-        self.htlcs = []
-
-        # generate HHTLC hashes for each part
-        for i in range(parts_count + redundant_parts_count):
-            # payment hash is fixed (just like a normal HTLC)
-            # payer preimage is random for each part
-            preimage = Preimage(self.amount_per_part, random_bytes(), self.set_id)
-            payment_hash = preimage.payment_hash()
-            htlc = HTLC(self.amount_per_part, payment_hash, self.set_id)
-            self.preimages.append(preimage)
-            self.htlcs.append(htlc)
+        super().__init__(payment_hash, amount, parts_count, redundant_parts_count)
+        self.htlcs = self.parts
+        # preimage of every part, built on access like the parts
+        self.preimages = engine.TableView(self.parts, self.preimage)
+
+    def part(self, index):
+        return HTLC(self.parts.amounts[index], self.parts.hash(index), self.set_id)
+
+    def preimage(self, index):
+        return Preimage(self.parts.amounts[index], self.secret(index), self.set_id)
 
 class Invoice:
+    __slots__ = ('amount', 'payment_hash')
+
     def __init__(self, amount):
         preimage = random_bytes()
         self.amount = amount
-        self.payment_hash = hashlib.sha256(preimage).hexdigest()
-
-class Node:
-    def __init__(self):
-        self.balance = 0
-        self.locked_balance = 0
-        self.payments = []
-        self.invoices = []
-        self.received_htlcs = []
-
-    # lock balance
-    def lock_balance(self, amount):
-        if self.balance < amount:
-            raise Exception("Insufficient balance")
-        self.balance -= amount
-        self.locked_balance += amount
-
-    # unlock balance
-    def unlock_balance(self, amount):
-        if self.locked_balance < amount:
-            raise Exception("Insufficient locked balance")
-        self.locked_balance -= amount
-        self.balance += amount
+        self.payment_hash = hashlib.sha256(preimage).digest()
+
+# HTLC with set id: every part has its own payment hash, parts of a payment share a set id
+class SetHTLCScheme(engine.HashLockScheme):
+    part_name = 'HTLC'
+    secret_name = 'preimage'
+
+    def new_invoice(self, amount):
+        return Invoice(amount)
+
+    def new_payment(self, payment_hash, amount, parts_count, redundant_parts_count):
+        return Payment(payment_hash, amount, parts_count, redundant_parts_count)
+
+    payment_key = operator.attrgetter('set_id')
+    part_payment_key = operator.attrgetter('set_id')
+    group_key = operator.attrgetter('set_id')
+    part_key = operator.attrgetter('payment_hash')
+    groups_by_payment_hash = False
+
+    def verify_claim(self, node, invoice, htlcs, preimages):
+        return self.verify_claims(node, [(invoice, htlcs, preimages)])[0]
+
+    # Every preimage is hashed and compared with the payment hash of its part, a plain loop
+    # is faster than hashing all preimages in a batch and comparing the joined digests.
+    def verify_claims(self, node, claims):
+        sha256 = hashlib.sha256
+        for _, htlcs, preimages in claims:
+            if node.verbose:
+                for index, part in enumerate(htlcs):
+                    node.log(f"Verify part {index} payment_hash: {part.payment_hash.hex()}")
+            # check preimages
+            for part, preimage in zip(htlcs, preimages):
+                if sha256(preimage).digest() != part.payment_hash:
+                    raise Exception("Invalid preimage")
+        return [None] * len(claims)
+
+class Node(engine.Node):
+    scheme = SetHTLCScheme()
 
     # payee create new invoice
     # return payment hash and amount
     def new_invoice(self, amount):
-        invoice = Invoice(amount)
-        self.invoices.append(invoice)
+        invoice = self.create_invoice(amount)
         return invoice.payment_hash, invoice.amount
 
     # payer gen redandent payment parts
     # return locked parts
     def pay(self, payment_hash, amount, parts_count, redundant_parts_count):
-        payment = Payment(payment_hash, amount, parts_count, redundant_parts_count)
-        self.lock_balance(payment.locked_amount)
-        self.payments.append(payment)
-        return payment.htlcs
+        return self.create_payment(payment_hash, amount, parts_count, redundant_parts_count).htlcs
 
     # payer reveal preimages of payment htlcs to payee
     def reveal_htlcs(self, htlcs):
-        # all parts should be from the same payment
-        set_id = None
-        for htlc in htlcs:
-            if set_id is None:
-                set_id = htlc.set_id
-            elif set_id != htlc.set_id:
-                raise Exception("HTLCs are from different payments")
-        
-        # find payment
-        payment = None
-        for p in self.payments:
-            if p.set_id == set_id:
-                payment = p
-                break
-        if payment is None:
-            raise Exception("Payment not found")
-            
-        # check total amount of parts
-        total_amount = sum([htlc.amount for htlc in htlcs])
-        if total_amount != payment.amount:
-            raise Exception(f"Reject to reveal htlcs because of invalid amount {total_amount} != {payment.amount}")
-
-        # find payer preimages for each part
-        preimages = []
-        for htlc in htlcs:
-            payment_hash = htlc.payment_hash
-            preimage = None
-            for p in payment.preimages:
-                if p.payment_hash() == payment_hash:
-                    preimage = p.preimage
-                    break
-            if preimage is None:
-                raise Exception("Payer preimage not found")
-            preimages.append(preimage)
-        
-        # check preimages count
-        if len(preimages) != len(htlcs):
-            raise Exception("Invalid preimages count")
-        return preimages
+        return self.reveal_parts(htlcs)
 
     # payee receive locked parts
     def receive_htlcs(self, htlcs):
-        # deduplicate parts
-        for htlc in htlcs:
-            if htlc not in self.received_htlcs:
-                self.received_htlcs.append(htlc)
-    
-    def find_invoice(self, payment_hash):
-        for invoice in self.invoices:
-            if invoice.payment_hash == payment_hash:
-                return invoice
-        return None
+        self.receive_parts(htlcs)
+
+    @property
+    def received_htlcs(self):
+        return self.received_parts()
 
     # return htlcs or None if not enough htlcs
     def get_received_htlcs(self, payment_hash, set_id):
-        invoice = self.find_invoice(payment_hash)
-        if invoice is None:
-            return None
-        htlcs = []
-        total_amount = 0
-        for htlc in self.received_htlcs:
-            if htlc.set_id == set_id:
-                htlcs.append(htlc)
-                total_amount += htlc.amount
-            if total_amount == invoice.amount:
-                break
-            # assume parts amount is fixed
-            if total_amount > invoice.amount:
-                raise Exception("Invalid payment amount")
-        # check if enough parts
-        if total_amount < invoice.amount:
-            print(f"Not enough htlcs, total amount: {total_amount}, invoice amount: {invoice.amount}")
-            return None
-        return htlcs
+        return self.get_received_parts(payment_hash, set_id)
 
     def claim(self, locked_parts, preimages):
-        # check preimages count
-        if len(preimages) != len(locked_parts):
-            raise Exception("Invalid preimages count")
-        # check preimages
-        for index, part in enumerate(locked_parts):
-            print(f"Verify part {index} payment_hash: {part.payment_hash}")
-            if not part.verify(preimages[index]):
-                raise Exception("Invalid preimage")
-
-        # Claim payment
-        print("Claim payment")
+        self.claim_parts(locked_parts, preimages)
+
+
+for method in ('new_invoice', 'pay', 'receive_htlcs', 'get_received_htlcs', 'reveal_htlcs', 'claim'):
+    profiling.register(Node, method, f'simple_spear.Node.{method}')
@@ -16,7 +16,7 @@ def run_test():
     # 1. Payee creates invoice
     amount = 100
     payment_hash, _ = payee.new_invoice(amount)
-    print(f"Payee created invoice with payment hash: {payment_hash}")
+    print(f"Payee created invoice with payment hash: {payment_hash.hex()}")
     
     # 2. Payer pays invoice
     parts_count = 5
@@ -1,191 +1,145 @@
 import hashlib
-import random
+import operator
+import struct
+from spear_core import engine, hashing, profiling, rand
+
+_payment_hash = operator.attrgetter('payment_hash')
+_payer_hash = operator.attrgetter('payer_hash')
 
 def random_bytes():
-    return random.randbytes(32)
+    return rand.random_bytes(32)
+
+class HTLC(engine.WireRecord):
+    __slots__ = ('amount', 'payment_hash', 'payer_hash')
+
+    # wire format: amount (f64) || payment hash (32 bytes) || payer hash (32 bytes)
+    wire_format = struct.Struct('<d32s32s')
 
-class HTLC:
     def __init__(self, amount, payment_hash, payer_hash):
         self.amount = amount
         self.payment_hash = payment_hash
         self.payer_hash = payer_hash
-    
+
     def verify(self, preimage, payer_preimage):
-        return self.payment_hash == hashlib.sha256(preimage).hexdigest() and self.payer_hash == hashlib.sha256(payer_preimage).hexdigest()
+        return self.payment_hash == hashlib.sha256(preimage).digest() and self.payer_hash == hashlib.sha256(payer_preimage).digest()
+
+class Preimage(engine.Record):
+    __slots__ = ('amount', 'payer_preimage')
 
-class Preimage:
     def __init__(self, amount, payer_preimage):
         self.amount = amount
         self.payer_preimage = payer_preimage
 
     def payer_hash(self):
-        return hashlib.sha256(self.payer_preimage).hexdigest()
+        return hashlib.sha256(self.payer_preimage).digest()
 
-class Payment:
+class Payment(engine.HashLockPayment):
     def __init__(self, payment_hash, amount, parts_count, redundant_parts_count):
-        self.payment_hash = payment_hash
-        self.amount = amount
-        self.amount_per_part = amount / parts_count
-        self.locked_amount = amount + self.amount_per_part * redundant_parts_count
-        self.parts_count = parts_count
-        self.redundant_parts_count = redundant_parts_count
-        self.preimages = []
-        self.htlcs = []
-
-        # generate HHTLC hashes for each part
-        for i in range(parts_count + redundant_parts_count):
-            # payment hash is fixed (just like a normal HTLC)
-            # payer preimage is random for each part
-            payer_preimage = random_bytes()
-            preimage = Preimage(self.amount_per_part, payer_preimage)
-            payer_hash = preimage.payer_hash()
-            htlc = HTLC(self.amount_per_part, self.payment_hash, payer_hash)
-            self.preimages.append(preimage)
-            self.htlcs.append(htlc)
+        # payment hash is fixed (just like a normal HTLC), payer hash is the hash of the
+        # random payer preimage of each part
+        super().__init__(payment_hash, amount, parts_count, redundant_parts_count)
+        self.htlcs = self.parts
+        # preimage of every part, built on access like the parts
+        self.preimages = engine.TableView(self.parts, self.preimage)
+
+    def part(self, index):
+        return HTLC(self.parts.amounts[index], self.payment_hash, self.parts.hash(index))
+
+    def preimage(self, index):
+        return Preimage(self.parts.amounts[index], self.secret(index))
 
 class Invoice:
+    __slots__ = ('preimage', 'amount', 'payment_hash')
+
     def __init__(self, amount):
         self.preimage = random_bytes()
         self.amount = amount
-        self.payment_hash = hashlib.sha256(self.preimage).hexdigest()
-
-class Node:
-    def __init__(self):
-        self.balance = 0
-        self.locked_balance = 0
-        self.payments = []
-        self.invoices = []
-        self.received_htlcs = []
-
-    # lock balance
-    def lock_balance(self, amount):
-        if self.balance < amount:
-            raise Exception("Insufficient balance")
-        self.balance -= amount
-        self.locked_balance += amount
-
-    # unlock balance
-    def unlock_balance(self, amount):
-        if self.locked_balance < amount:
-            raise Exception("Insufficient locked balance")
-        self.locked_balance -= amount
-        self.balance += amount
+        self.payment_hash = hashlib.sha256(self.preimage).digest()
+
+# HHTLC: every part is locked by the invoice payment hash and a per part payer hash
+class HHTLCScheme(engine.HashLockScheme):
+    part_name = 'HTLC'
+    secret_name = 'preimage'
+
+    def new_invoice(self, amount):
+        return Invoice(amount)
+
+    def new_payment(self, payment_hash, amount, parts_count, redundant_parts_count):
+        return Payment(payment_hash, amount, parts_count, redundant_parts_count)
+
+    part_key = operator.attrgetter('payer_hash')
+
+    def verify_claim(self, node, invoice, htlcs, payer_preimages):
+        return self.verify_claims(node, [(invoice, htlcs, payer_preimages)])[0]
+
+    # The invoice preimage is hashed once per payment, payer preimages of all payments are
+    # hashed in one batch and all digests are checked with a single raw bytes comparison.
+    def verify_claims(self, node, claims):
+        payer_hashes = []
+        payer_preimages = []
+        for invoice, htlcs, preimages in claims:
+            # get preimage from invoices
+            if invoice is None:
+                raise Exception("Preimage not found")
+            if node.verbose:
+                for index, htlc in enumerate(htlcs):
+                    node.log(f"Verify part {index} payment_hash: {htlc.payment_hash.hex()}  payer_hash: {htlc.payer_hash.hex()}")
+            # check payment hash, it is the same for every part
+            if set(map(_payment_hash, htlcs)) != {hashing.sha256(invoice.preimage)}:
+                raise Exception("Invalid preimage")
+            payer_hashes.extend(map(_payer_hash, htlcs))
+            payer_preimages.extend(preimages)
+        # check preimages
+        if b''.join(hashing.sha256_batch(payer_preimages)) != b''.join(payer_hashes):
+            raise Exception("Invalid preimage")
+        return [None] * len(claims)
+
+    # the invoice preimage proves the payment
+    def proof(self, invoice):
+        return invoice.preimage
+
+class Node(engine.Node):
+    scheme = HHTLCScheme()
 
     # payee create new invoice
     # return payment hash and amount
     def new_invoice(self, amount):
-        invoice = Invoice(amount)
-        self.invoices.append(invoice)
+        invoice = self.create_invoice(amount)
         return invoice.payment_hash, invoice.amount
 
     # payer gen redandent payment parts
     # return locked parts
     def pay(self, payment_hash, amount, parts_count, redundant_parts_count):
-        payment = Payment(payment_hash, amount, parts_count, redundant_parts_count)
-        self.lock_balance(payment.locked_amount)
-        self.payments.append(payment)
-        return payment.htlcs
+        return self.create_payment(payment_hash, amount, parts_count, redundant_parts_count).htlcs
 
     # payer reveal preimages of payment parts to payee
     def reveal_htlcs(self, locked_htlcs):
-        # all parts should be from the same payment
-        payment_hash = None
-        for htlc in locked_htlcs:
-            if payment_hash is None:
-                payment_hash = htlc.payment_hash
-            elif payment_hash != htlc.payment_hash:
-                raise Exception("HTLCs are from different payments")
-        
-        # find payment
-        payment = None
-        for p in self.payments:
-            if p.payment_hash == payment_hash:
-                payment = p
-                break
-        if payment is None:
-            raise Exception("Payment not found")
-            
-        # check total amount of parts
-        total_amount = sum([htlc.amount for htlc in locked_htlcs])
-        if total_amount != payment.amount:
-            raise Exception(f"Reject to reveal htlcs because of invalid amount {total_amount} != {payment.amount}")
-
-        # find payer preimages for each part
-        payer_preimages = []
-        for htlc in locked_htlcs:
-            payer_hash = htlc.payer_hash
-            payer_preimage = None
-            for p in payment.preimages:
-                if p.payer_hash() == payer_hash:
-                    payer_preimage = p.payer_preimage
-                    break
-            if payer_preimage is None:
-                raise Exception("Payer preimage not found")
-            payer_preimages.append(payer_preimage)
-        
-        # check preimages count
-        if len(payer_preimages) != len(locked_htlcs):
-            raise Exception("Invalid preimages count")
-        return payer_preimages
+        return self.reveal_parts(locked_htlcs)
 
     # payee receive locked parts
     def receive_htlcs(self, locked_htlcs):
-        # deduplicate parts
-        for htlc in locked_htlcs:
-            if htlc not in self.received_htlcs:
-                self.received_htlcs.append(htlc)
-    
-    def find_invoice(self, payment_hash):
-        for invoice in self.invoices:
-            if invoice.payment_hash == payment_hash:
-                return invoice
-        return None
+        self.receive_parts(locked_htlcs)
+
+    @property
+    def received_htlcs(self):
+        return self.received_parts()
 
     # return htlcs or None if not enough htlcs
     def get_received_htlcs(self, payment_hash):
+        return self.get_received_parts(payment_hash)
+
+    def claim(self, htlcs, payer_preimages):
+        self.claim_parts(htlcs, payer_preimages)
+
+    def get_preimage(self, payment_hash):
         invoice = self.find_invoice(payment_hash)
         if invoice is None:
+            # settled invoices only keep their preimage in the proof archive
+            if self.retention is not None:
+                return self.retention.archive.get(payment_hash)
             return None
-        htlcs = []
-        total_amount = 0
-        for htlc in self.received_htlcs:
-            if htlc.payment_hash == payment_hash:
-                htlcs.append(htlc)
-                total_amount += htlc.amount
-            if total_amount == invoice.amount:
-                break
-            # assume parts amount is fixed
-            if total_amount > invoice.amount:
-                raise Exception("Invalid payment amount")
-        # check if enough parts
-        if total_amount < invoice.amount:
-            return None
-        return htlcs
-
-    def claim(self, htlcs, payer_preimages):
-        payment_hash = htlcs[0].payment_hash
-        # get preimage from invoices
-        preimage = None
-        for invoice in self.invoices:
-            if invoice.payment_hash == payment_hash:
-                preimage = invoice.preimage
-                break
-        if preimage is None:
-            raise Exception("Preimage not found")
-        # check preimages count
-        if len(payer_preimages) != len(htlcs):
-            raise Exception("Invalid preimages count")
-        # check preimages
-        for index, htlc in enumerate(htlcs):
-            print(f"Verify part {index} payment_hash: {htlc.payment_hash}  payer_hash: {htlc.payer_hash}")
-            if not htlc.verify(preimage, payer_preimages[index]):
-                raise Exception("Invalid preimage")
+        return invoice.preimage
 
-        # Claim payment
-        print("Claim payment")
 
-    def get_preimage(self, payment_hash):
-        for invoice in self.invoices:
-            if invoice.payment_hash == payment_hash:
-                return invoice.preimage
-        return None
+for method in ('new_invoice', 'pay', 'receive_htlcs', 'get_received_htlcs', 'reveal_htlcs', 'claim'):
+    profiling.register(Node, method, f'spear.Node.{method}')
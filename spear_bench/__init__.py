@@ -0,0 +1,14 @@
+# spear_bench package
+import importlib
+
+__all__ = ['claims', 'cli', 'curve', 'hashes', 'imports', 'memory', 'pipeline', 'proofs', 'retention', 'retry', 'runner', 'schnorr', 'shard', 'workloads', 'main']
+
+
+# submodules are imported on first use (PEP 562)
+def __getattr__(name):
+    if name == 'main':
+        from spear_bench.cli import main
+        return main
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,10 @@
+"""
+Spear benchmark suites main entry point.
+Run with: python -m spear_bench [suite] [options]
+"""
+import sys
+
+from spear_bench.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import time
+
+from spear_bench.workloads import quiet
+
+NAME = 'claims'
+HELP = 'HTLC claim verification throughput, per-part vs batched hashing'
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help='parts per claim (default: 10 100 1000 10000 100000)')
+    parser.add_argument('--variant', action='append', choices=('spear', 'simple_spear'),
+                        help='variant to run, repeat for several (default: both)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions, the best one is reported')
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def spear_claim(size):
+    from spear.node import Node
+    payer, payee = quiet(Node()), quiet(Node())
+    payer.balance = size * 1000
+    payment_hash, _ = payee.new_invoice(size * 1000)
+    htlcs = payer.pay(payment_hash, size * 1000, size, 0)
+    payee.receive_htlcs(htlcs)
+    received = payee.get_received_htlcs(payment_hash)
+    secrets = payer.reveal_htlcs(received)
+    preimage = payee.get_preimage(payment_hash)
+
+    def per_part():
+        for index, htlc in enumerate(received):
+            if not htlc.verify(preimage, secrets[index]):
+                raise Exception("Invalid preimage")
+
+    return per_part, lambda: payee.claim(received, secrets)
+
+
+def simple_spear_claim(size):
+    from simple_spear.node import Node
+    payer, payee = quiet(Node()), quiet(Node())
+    payer.balance = size * 1000
+    payment_hash, _ = payee.new_invoice(size * 1000)
+    htlcs = payer.pay(payment_hash, size * 1000, size, 0)
+    payee.receive_htlcs(htlcs)
+    received = payee.get_received_htlcs(payment_hash, htlcs[0].set_id)
+    secrets = payer.reveal_htlcs(received)
+
+    def per_part():
+        for index, htlc in enumerate(received):
+            if not htlc.verify(secrets[index]):
+                raise Exception("Invalid preimage")
+
+    return per_part, lambda: payee.claim(received, secrets)
+
+
+CLAIMS = {'spear': spear_claim, 'simple_spear': simple_spear_claim}
+
+
+def run(args):
+    results = {}
+    for variant in args.variant or CLAIMS:
+        for size in args.sizes:
+            per_part, batch = CLAIMS[variant](size)
+            for mode, fn in (('per_part', per_part), ('batch', batch)):
+                elapsed = best_of(args.repeat, fn)
+                results[f'{variant}/{mode}/{size}'] = {
+                    'ops': size,
+                    'ops_per_sec': size / elapsed,
+                    'p50_ms': elapsed * 1000,
+                }
+    return results
@@ -0,0 +1,92 @@
+import argparse
+import contextlib
+import random
+import sys
+
+from spear_bench import (
+    claims, curve, hashes, imports, memory, pipeline, proofs, retention, retry, runner, schnorr, shard, workloads,
+)
+from spear_core import profiling, rand
+
+SUITES = {
+    suite.NAME: suite
+    for suite in (workloads, schnorr, claims, hashes, shard, pipeline, retention, memory, imports, proofs, retry, curve)
+}
+DEFAULT_SUITE = workloads.NAME
+# options which only change how a run is reported, not what is measured
+OUTPUT_OPTIONS = ('save', 'baseline', 'tolerance', 'profile', 'hotspots', 'hotspots_out')
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--seed', type=int, default=None, help='seed for reproducible runs, also makes node secrets deterministic')
+    common.add_argument('--save', metavar='PATH', help='write results as JSON to PATH')
+    common.add_argument('--baseline', metavar='PATH', help='compare results against a saved JSON baseline')
+    common.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression against the baseline (default: 0.25)')
+    common.add_argument('--profile', action='store_true',
+                        help='collect operation counters and timings, stored with the results')
+    common.add_argument('--hotspots', choices=('cprofile', 'pyinstrument'),
+                        help='capture hotspots of the run with a profiler')
+    common.add_argument('--hotspots-out', metavar='PATH', help='save the raw profiler output to PATH')
+
+    parser = argparse.ArgumentParser(prog='python -m spear_bench', description='Spear benchmark suites')
+    subparsers = parser.add_subparsers(dest='suite')
+    for suite in SUITES.values():
+        suite.add_arguments(subparsers.add_parser(suite.NAME, help=suite.HELP, parents=[common]))
+    return parser
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # the protocol suite is the default one
+    if not argv or (argv[0] not in SUITES and argv[0] not in ('-h', '--help')):
+        argv.insert(0, DEFAULT_SUITE)
+    args = build_parser().parse_args(argv)
+    suite = SUITES[args.suite]
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        rand.seed(args.seed)
+    with contextlib.ExitStack() as stack:
+        if args.profile:
+            stack.enter_context(profiling.collecting())
+        report = None
+        if args.hotspots:
+            report = stack.enter_context(profiling.hotspots(args.hotspots, args.hotspots_out))
+        results = suite.run(args)
+
+    params = {k: v for k, v in vars(args).items() if k not in OUTPUT_OPTIONS}
+    document = {'suite': suite.NAME, 'params': params, 'env': runner.environment(), 'results': results}
+    print(runner.format_table(results))
+
+    if args.profile:
+        document['profile'] = profiling.snapshot()
+        print(profiling.format_snapshot(document['profile']))
+    if report is not None:
+        print(report.text)
+
+    if args.save:
+        runner.save_results(args.save, document)
+        print(f"Saved results to {args.save}")
+
+    # suites may check their results against their own limits, e.g. a time budget
+    check = getattr(suite, 'check', None)
+    failures = check(results, args) if check is not None else []
+    if failures:
+        print(f"{len(failures)} check(s) failed:")
+        for failure in failures:
+            print(f"  {failure}")
+
+    if args.baseline:
+        baseline = runner.load_results(args.baseline)
+        if baseline.get('params') != params:
+            print(f"Warning: {args.baseline} was recorded with different parameters")
+        regressions = runner.compare(baseline, document, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 1 if failures else 0
@@ -0,0 +1,107 @@
+import random
+import time
+
+from spear_bench.workloads import quiet
+
+NAME = 'curve'
+HELP = 'curve core speedups over the reference arithmetic, checked against it'
+
+# Speedups gated by the suite: (workload, workload it is measured against, metric compared,
+# option of the smallest accepted speedup). Both sides are measured in the same run, so the
+# gate doesn't depend on the speed of the machine. A claim checks one secret per part, its
+# parts per second are compared with the reference G * k.
+SPEEDUPS = (
+    ('G*k/mul_g', 'G*k/reference', 'ops_per_sec', 'min_mul_g_speedup'),
+    ('verify/batch', 'verify/single', 'ops_per_sec', 'min_batch_speedup'),
+    ('claim/{parts}', 'G*k/reference', 'parts_per_sec', 'min_claim_speedup'),
+)
+
+
+def add_arguments(parser):
+    parser.add_argument('--ops', type=int, default=20, help='operations per repetition')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions, the best one is kept')
+    parser.add_argument('--parts', type=int, default=4, help='parts per claimed PTLC payment')
+    parser.add_argument('--cases', type=int, default=8,
+                        help='random inputs per differential check on top of the edge cases, 0 skips the checks')
+    parser.add_argument('--min-mul-g-speedup', type=float, default=4.0,
+                        help='smallest accepted speedup of mul_g over G * k (default: 4)')
+    parser.add_argument('--min-batch-speedup', type=float, default=1.5,
+                        help='smallest accepted speedup of batch over single signature verification (default: 1.5)')
+    parser.add_argument('--min-claim-speedup', type=float, default=4.0,
+                        help='smallest accepted speedup of claimed parts over G * k (default: 4)')
+
+
+# best throughput of fn over the items, out of `repeat` runs
+def throughput(fn, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(*item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'ops': len(items), 'ops_per_sec': len(items) / best}
+
+
+# best throughput of fn checking all the items in one batch, out of `repeat` runs
+def batch_throughput(fn, items, repeat):
+    batch = throughput(fn, [(items,)], repeat)
+    return {'ops': len(items), 'ops_per_sec': len(items) * batch['ops_per_sec']}
+
+
+def run(args):
+    from spear_ptlc import schnorr, secp256k1
+    from spear_ptlc.node import Node
+
+    rng = random.Random(args.seed)
+    secp256k1.g_table()
+    scalars = [(secp256k1.Fr(rng.randrange(1, secp256k1.N)),) for _ in range(args.ops)]
+    signatures = []
+    for i in range(args.ops):
+        prikey = schnorr.random_scalar()
+        m = schnorr.hash_message(i.to_bytes(8, 'little'))
+        R, s = schnorr.sign(prikey, m)
+        signatures.append((R, s, secp256k1.mul_g(prikey), m))
+
+    payer = quiet(Node())
+    payee = quiet(Node())
+    claims = []
+    for _ in range(args.ops):
+        payment_hash, pubkey, amount = payee.new_invoice(args.parts * 1000)
+        payer.balance += amount
+        ptlcs = payer.pay(pubkey, amount, args.parts, 0)
+        payee.receive_ptlcs(ptlcs)
+        ptlcs = payee.get_received_ptlcs(payment_hash)
+        claims.append((ptlcs, payer.reveal_ptlcs(ptlcs)))
+
+    results = {
+        'G*k/reference': throughput(lambda k: secp256k1.G * k, scalars, args.repeat),
+        'G*k/mul_g': throughput(secp256k1.mul_g, scalars, args.repeat),
+        'verify/single': throughput(schnorr.verify, signatures, args.repeat),
+        'verify/batch': batch_throughput(schnorr.batch_verify, signatures, args.repeat),
+        f'claim/{args.parts}': throughput(payee.claim, claims, args.repeat),
+    }
+    claim = results[f'claim/{args.parts}']
+    claim['parts_per_sec'] = claim['ops_per_sec'] * args.parts
+    for name, base, metric, _ in SPEEDUPS:
+        result = results[name.format(parts=args.parts)]
+        result['speedup'] = result[metric] / results[base]['ops_per_sec']
+    return results
+
+
+# speedups below their floor, and optimized curve paths which disagree with the reference
+# arithmetic
+def check(results, args):
+    failures = []
+    for name, base, _, option in SPEEDUPS:
+        name = name.format(parts=args.parts)
+        speedup = results[name]['speedup']
+        if speedup < getattr(args, option):
+            failures.append(f"{name} is {speedup:.2f}x {base}, below {getattr(args, option):g}x")
+    if not args.cases:
+        return failures
+    from spear_ptlc import differential
+
+    harness = differential.run(args.cases, args.seed)
+    print(f"Differential checks: {harness.checks} checks, {len(harness.failures)} failure(s)")
+    return failures + harness.failures
@@ -0,0 +1,71 @@
+import gc
+import hashlib
+import time
+import tracemalloc
+
+from spear.node import HTLC, Node
+from spear_bench.workloads import quiet
+
+NAME = 'hashes'
+HELP = 'memory and throughput of received parts keyed by hex vs raw digests'
+
+
+def add_arguments(parser):
+    parser.add_argument('--parts', type=int, default=1_000_000, help='received parts (default: 1000000)')
+    parser.add_argument('--payments', type=int, default=1000, help='payments the parts belong to')
+
+
+# Parts of `payments` payments with either raw 32-byte digests or 64-character hexdigest strings.
+def make_parts(count, payments, encode):
+    payment_hashes = [encode(hashlib.sha256(i.to_bytes(8, 'little')).digest()) for i in range(payments)]
+    return [
+        HTLC(1000, payment_hashes[i % payments], encode(hashlib.sha256(i.to_bytes(8, 'big')).digest()))
+        for i in range(count)
+    ]
+
+
+def receive(parts):
+    node = quiet(Node())
+    start = time.perf_counter()
+    node.receive_htlcs(parts)
+    elapsed = time.perf_counter() - start
+    return node, elapsed
+
+
+def measure(count, payments, encode, repeat=3):
+    # memory of the parts and of the payee index, traced in a separate pass
+    gc.collect()
+    tracemalloc.start()
+    parts = make_parts(count, payments, encode)
+    node, _ = receive(parts)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del node
+
+    receive_time = lookup_time = None
+    for _ in range(repeat):
+        gc.collect()
+        node, elapsed = receive(parts)
+        receive_time = elapsed if receive_time is None else min(receive_time, elapsed)
+        # look every part up again, as a payer revealing them would
+        keys = node.received_keys
+        start = time.perf_counter()
+        for part in parts:
+            if part.payer_hash not in keys:
+                raise Exception("Part not found")
+        elapsed = time.perf_counter() - start
+        lookup_time = elapsed if lookup_time is None else min(lookup_time, elapsed)
+        del node, keys
+    return {
+        'ops': count,
+        'ops_per_sec': count / receive_time,
+        'lookups_per_sec': count / lookup_time,
+        'memory_mb': memory / 2 ** 20,
+    }
+
+
+def run(args):
+    return {
+        f'hex/{args.parts}': measure(args.parts, args.payments, bytes.hex),
+        f'bytes/{args.parts}': measure(args.parts, args.payments, bytes),
+    }
@@ -0,0 +1,52 @@
+import os
+import statistics
+import subprocess
+import sys
+
+NAME = 'imports'
+HELP = 'import time of the packages (python -X importtime), checked against a budget'
+
+MODULES = ('spear', 'simple_spear', 'spear_ptlc', 'spear_core', 'spear.node', 'simple_spear.node', 'spear_ptlc.node')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def add_arguments(parser):
+    parser.add_argument('--modules', nargs='+', default=list(MODULES), help='modules to import')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per module')
+    parser.add_argument('--budget-ms', type=float, default=50.0,
+                        help='fail when the fastest import of a module takes longer (default: 50)')
+
+
+# cumulative import time of `module` in microseconds, measured in a fresh interpreter
+def import_time(module):
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    # lines are "import time: self [us] | cumulative | imported package"
+    for line in proc.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise Exception(f"No import time reported for {module}")
+
+
+def run(args):
+    results = {}
+    for module in args.modules:
+        times = [import_time(module) / 1000 for _ in range(args.repeat)]
+        results[module] = {
+            'ops': args.repeat,
+            'p50_ms': statistics.median(times),
+            'min_ms': min(times),
+            'budget_ms': args.budget_ms,
+        }
+    return results
+
+
+# modules over budget
+def check(results, args):
+    return [
+        f"{module}: {metrics['min_ms']:.1f} ms > {args.budget_ms:.1f} ms budget"
+        for module, metrics in results.items() if metrics['min_ms'] > args.budget_ms
+    ]
@@ -0,0 +1,67 @@
+import gc
+import tracemalloc
+
+from spear_bench.workloads import quiet
+
+NAME = 'memory'
+HELP = 'peak memory of payer payments and payee received parts'
+
+
+def add_arguments(parser):
+    parser.add_argument('--variant', choices=('spear', 'simple', 'all'), default='all', help='protocol variant (default: all)')
+    parser.add_argument('--payments', type=int, default=100, help='payments made by the payer')
+    parser.add_argument('--parts', type=int, default=1000, help='parts per payment')
+
+
+def node_module(variant):
+    if variant == 'spear':
+        from spear import node
+    else:
+        from simple_spear import node
+    return node
+
+
+# peak traced memory of fn, on top of what is allocated before
+def traced(fn):
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+def metrics(count, peak):
+    return {'ops': count, 'memory_mb': peak / 2 ** 20, 'bytes_per_part': peak / count}
+
+
+def run(args):
+    results = {}
+    for variant in (('spear', 'simple') if args.variant == 'all' else (args.variant,)):
+        module = node_module(variant)
+        Node = module.Node
+        amount = args.parts * 1000
+
+        def pay():
+            payer = quiet(Node())
+            payer.balance = amount * args.payments
+            for _ in range(args.payments):
+                payer.create_payment(Node.scheme.new_invoice(amount).payment_hash, amount, args.parts, 0)
+            return payer
+
+        payer, peak = traced(pay)
+        count = args.payments * args.parts
+        results[f'{variant}/payer/{count}'] = metrics(count, peak)
+
+        # the payee receives every part of the payer payments off the wire
+        encoded = [part.encode() for payment in payer.payments.values() for part in payment.parts]
+        del payer
+
+        def receive():
+            payee = quiet(Node())
+            payee.receive_htlcs(module.HTLC.decode_batch(encoded))
+            return payee
+
+        _, peak = traced(receive)
+        results[f'{variant}/payee/{count}'] = metrics(count, peak)
+    return results
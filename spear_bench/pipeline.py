@@ -0,0 +1,135 @@
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+from spear_bench.workloads import quiet
+from spear_core.pipeline import Pipeline
+
+NAME = 'pipeline'
+HELP = 'streaming ingestion throughput and memory growth of HTLC payees'
+
+
+def add_arguments(parser):
+    parser.add_argument('--variant', choices=('spear', 'simple', 'all'), default='all', help='protocol variant (default: all)')
+    parser.add_argument('--mode', choices=('sync', 'async', 'all'), default='all', help='pipeline driver (default: all)')
+    parser.add_argument('--payments', type=int, default=20000, help='payments streamed to the payee')
+    parser.add_argument('--parts', type=int, default=8, help='parts per payment')
+    parser.add_argument('--redundancy', type=int, default=2, help='redundant parts per payment')
+    parser.add_argument('--duplicates', type=float, default=0.05, help='fraction of parts delivered twice')
+    parser.add_argument('--window', type=int, default=64, help='payments in flight at once, their parts are interleaved')
+    parser.add_argument('--batch', type=int, default=256, help='parts per wire batch')
+    parser.add_argument('--claim-batch', type=int, default=64, help='payments claimed per micro-batch')
+
+
+def node_module(variant):
+    if variant == 'spear':
+        from spear import node
+    else:
+        from simple_spear import node
+    return node
+
+
+# Pre-generate everything the payee is sent: windows of (invoices, wire batches) and the
+# payer secrets of every part, so that only the payee side is measured.
+def make_stream(variant, args):
+    Node = node_module(variant).Node
+    rng = random.Random(args.payments)
+    payer = quiet(Node())
+    amount = args.parts * 1000
+    windows = []
+    secrets = {}
+    resolved = {}
+    part_key = Node.scheme.part_key
+    for start in range(0, args.payments, args.window):
+        invoices = []
+        parts = []
+        for _ in range(min(args.window, args.payments - start)):
+            invoice = Node.scheme.new_invoice(amount)
+            payer.balance += amount * 2
+            payment = payer.create_payment(invoice.payment_hash, amount, args.parts, args.redundancy)
+            for part, secret in zip(payment.parts, Node.scheme.reveal_all(payment, payment.parts)):
+                secrets[part_key(part)] = secret
+            resolved[Node.scheme.group_key(payment.parts[0])] = invoice.payment_hash
+            invoices.append(invoice)
+            parts.extend(payment.parts)
+        parts.extend(rng.sample(parts, int(len(parts) * args.duplicates)))
+        rng.shuffle(parts)
+        encoded = [part.encode() for part in parts]
+        batches = [b''.join(encoded[i:i + args.batch]) for i in range(0, len(encoded), args.batch)]
+        windows.append((invoices, batches))
+    payer.payments.clear()
+    return windows, secrets, resolved
+
+
+def source(payee, windows, mark=None):
+    for index, (invoices, batches) in enumerate(windows):
+        if mark is not None and index == len(windows) // 4:
+            mark()
+        # payees learn about invoices as the payments start
+        for invoice in invoices:
+            payee.add_invoice(invoice)
+        yield from batches
+
+
+def ingest(variant, mode, stream, args, trace=False):
+    module = node_module(variant)
+    Node = module.Node
+    windows, secrets, resolved = stream
+    part_key = Node.scheme.part_key
+    payee = quiet(Node())
+    pipeline = Pipeline(
+        payee,
+        reveal=lambda parts: [secrets[part_key(part)] for part in parts],
+        decode=module.HTLC.decode_buffer,
+        resolve=(lambda part: resolved.get(part.set_id)) if variant == 'simple' else None,
+        batch_size=args.claim_batch,
+    )
+    marks = []
+
+    def mark():
+        marks.append(tracemalloc.get_traced_memory()[0] if trace else 0)
+
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if mode == 'sync':
+        for _ in pipeline.run(source(payee, windows, mark)):
+            pass
+    else:
+        async def drain():
+            async for _ in pipeline.run_async(source(payee, windows, mark)):
+                pass
+        asyncio.run(drain())
+    elapsed = time.perf_counter() - start
+    growth = 0
+    if trace:
+        growth = tracemalloc.get_traced_memory()[0] - marks[0]
+        tracemalloc.stop()
+    if pipeline.stats.claimed != args.payments:
+        raise Exception(f"Claimed {pipeline.stats.claimed} of {args.payments} payments")
+    return pipeline.stats, elapsed, growth, len(payee.received) + len(payee.invoices)
+
+
+def run(args):
+    variants = ('spear', 'simple') if args.variant == 'all' else (args.variant,)
+    modes = ('sync', 'async') if args.mode == 'all' else (args.mode,)
+    results = {}
+    for variant in variants:
+        stream = make_stream(variant, args)
+        for mode in modes:
+            stats, elapsed, _, _ = ingest(variant, mode, stream, args)
+            # memory is traced in a separate pass, tracing slows the pipeline down
+            _, _, growth, left = ingest(variant, mode, stream, args, trace=True)
+            results[f'{variant}/{mode}'] = {
+                'ops': stats.parts,
+                'ops_per_sec': stats.parts / elapsed,
+                'payments_per_sec': stats.claimed / elapsed,
+                'duplicates': stats.duplicates,
+                'rejected': stats.rejected,
+                'memory_growth_mb': growth / 2 ** 20,
+                'state_left': left,
+            }
+    return results
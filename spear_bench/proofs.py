@@ -0,0 +1,76 @@
+import time
+
+from spear_bench.workloads import quiet
+
+NAME = 'proofs'
+HELP = 'PTLC payment proof extraction by payers and proof verification'
+
+
+def add_arguments(parser):
+    parser.add_argument('--payments', type=int, default=5, help='payments to extract proofs from')
+    parser.add_argument('--parts', type=int, default=100, help='parts per payment')
+    parser.add_argument('--proofs', type=int, default=200, help='proofs verified')
+
+
+def timed(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return time.perf_counter() - start
+
+
+def metrics(count, elapsed):
+    return {'ops': count, 'ops_per_sec': count / elapsed, 'p50_ms': elapsed / count * 1000}
+
+
+# extraction as the payer did it by hand: subtract hop secrets from every claim secret, then
+# compare G * proof with the invoice pubkey
+def extract_by_hand(payer, payment_hash, claim_secrets):
+    from spear_ptlc import secp256k1
+
+    payment = payer.find_payment(payment_hash)
+    proof = None
+    for ptlc, claim_secret in zip(payment.revealed, claim_secrets):
+        secret = claim_secret - payment.hop_secrets[ptlc.id]
+        if proof is None:
+            proof = secret
+        if proof != secret:
+            raise Exception("Payment proof is not consistent")
+    if secp256k1.G * proof != payment.pubkey.pubkey:
+        raise Exception("Payment proof is not verified")
+    return proof
+
+
+def run(args):
+    from spear_ptlc import secp256k1
+    from spear_ptlc.node import Node, SecretKey, verify_proof, verify_proofs
+
+    payer = quiet(Node())
+    claims = []
+    for _ in range(args.payments):
+        invoice = Node.scheme.new_invoice(args.parts * 1000)
+        payer.balance += invoice.amount
+        ptlcs = payer.pay(invoice.pubkey, invoice.amount, args.parts, 0)
+        secrets = payer.reveal_ptlcs(ptlcs)
+        # claim secrets as the payee computes them, without checking the parts
+        claims.append((invoice.payment_hash, [invoice.secret_key.k + secret for secret in secrets]))
+
+    results = {
+        f'extract/by_hand/{args.parts}': metrics(args.payments, timed(lambda c: extract_by_hand(payer, *c), claims)),
+        f'extract/api/{args.parts}': metrics(args.payments, timed(lambda c: payer.extract_payment_proof(*c), claims)),
+        # proofs are already checked against the invoice pubkeys
+        f'extract/api_cached/{args.parts}': metrics(args.payments, timed(lambda c: payer.extract_payment_proof(*c), claims)),
+    }
+
+    keys = [SecretKey() for _ in range(args.proofs)]
+    pairs = [(key.pubkey(), key.k) for key in keys]
+    results[f'verify/G*k/{args.proofs}'] = metrics(
+        args.proofs, timed(lambda pair: secp256k1.G * pair[1] == pair[0].pubkey, pairs))
+    results[f'verify/single/{args.proofs}'] = metrics(args.proofs, timed(lambda pair: verify_proof(*pair), pairs))
+    results[f'verify/batch/{args.proofs}'] = metrics(args.proofs, timed(verify_proofs, [pairs]))
+    for name, fn, items in (('single', lambda pair: verify_proof(*pair), pairs), ('batch', verify_proofs, [pairs])):
+        if not all(map(fn, items)):
+            raise Exception(f"Valid proofs failed {name} verification")
+    if verify_proofs(pairs[:-1] + [(pairs[-1][0], pairs[-1][1] + secp256k1.Fr(1))]):
+        raise Exception("Invalid proof passed batch verification")
+    return results
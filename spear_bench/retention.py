@@ -0,0 +1,86 @@
+import gc
+import random
+import time
+import tracemalloc
+
+from spear.node import Node
+from spear_bench.workloads import quiet
+from spear_core.retention import Retention
+
+NAME = 'retention'
+HELP = 'payee memory with and without retention of settled and abandoned payments'
+
+
+def add_arguments(parser):
+    parser.add_argument('--payments', type=int, default=20000, help='payments sent to the payee')
+    parser.add_argument('--parts', type=int, default=8, help='parts per payment')
+    parser.add_argument('--abandoned', type=float, default=0.2,
+                        help='fraction of payments which never complete (default: 0.2)')
+    parser.add_argument('--ttl', type=int, default=100, help='ttl in payments for the ttl policy')
+    parser.add_argument('--max-entries', type=int, default=1000, help='entry cap for the cap policy')
+
+
+# Pre-generate the invoices and parts, abandoned payments only deliver half of their parts.
+def make_payments(args):
+    rng = random.Random(args.payments)
+    payer = quiet(Node())
+    amount = args.parts * 1000
+    payments = []
+    for _ in range(args.payments):
+        invoice = Node.scheme.new_invoice(amount)
+        payer.balance += amount
+        payment = payer.create_payment(invoice.payment_hash, amount, args.parts, 0)
+        htlcs = payment.htlcs
+        if rng.random() < args.abandoned:
+            payments.append((invoice, htlcs[:args.parts // 2], None))
+        else:
+            payments.append((invoice, htlcs, payer.reveal_htlcs(htlcs)))
+    return payments
+
+
+def replay(payments, retention, clock):
+    payee = quiet(Node())
+    # the retention takes its first sweep time from the clock, it starts over on every replay
+    clock[0] = 0
+    payee.retention = retention() if retention is not None else None
+    start = time.perf_counter()
+    for index, (invoice, htlcs, preimages) in enumerate(payments):
+        clock[0] = index
+        payee.add_invoice(invoice)
+        payee.receive_htlcs(htlcs)
+        if preimages is not None:
+            payee.claim(payee.get_received_htlcs(invoice.payment_hash), preimages)
+    return payee, time.perf_counter() - start
+
+
+def measure(payments, retention, clock):
+    gc.collect()
+    _, elapsed = replay(payments, retention, clock)
+    # memory is traced in a separate pass, tracing slows the payee down
+    gc.collect()
+    tracemalloc.start()
+    payee, _ = replay(payments, retention, clock)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    result = {
+        'ops': len(payments),
+        'ops_per_sec': len(payments) / elapsed,
+        'memory_mb': memory / 2 ** 20,
+        'invoices': len(payee.invoices),
+        'received': len(payee.received),
+    }
+    if payee.retention is not None:
+        result.update(payee.retention.metrics())
+    return result
+
+
+def run(args):
+    payments = make_payments(args)
+    # the clock counts payments so that runs don't depend on the speed of the machine
+    clock = [0]
+    policies = {
+        'none': None,
+        f'ttl/{args.ttl}': lambda: Retention(ttl=args.ttl, clock=lambda: clock[0]),
+        f'cap/{args.max_entries}': lambda: Retention(max_entries=args.max_entries, clock=lambda: clock[0]),
+    }
+    return {name: measure(payments, retention, clock) for name, retention in policies.items()}
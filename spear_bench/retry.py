@@ -0,0 +1,139 @@
+import random
+import statistics
+import time
+
+from spear_bench.workloads import quiet
+from spear_core.retry import PaymentRetry
+
+NAME = 'retry'
+HELP = 'payments over a lossy network: resending with redundant parts vs paying again'
+
+
+def add_arguments(parser):
+    parser.add_argument('--variant', choices=('spear', 'simple_spear', 'spear_ptlc'), default='spear',
+                        help='protocol variant (default: spear)')
+    parser.add_argument('--payments', type=int, default=200, help='payments to complete')
+    parser.add_argument('--parts', type=int, default=8, help='parts per payment')
+    parser.add_argument('--redundancy', type=int, default=2, help='redundant parts per payment')
+    parser.add_argument('--loss', type=float, default=0.1, help='probability that a part fails (default: 0.1)')
+    parser.add_argument('--max-rounds', type=int, default=100,
+                        help='give up on a payment after this many rounds (default: 100)')
+
+
+def node_class(variant):
+    if variant == 'spear':
+        from spear.node import Node
+    elif variant == 'simple_spear':
+        from simple_spear.node import Node
+    else:
+        from spear_ptlc.node import Node
+    return Node
+
+
+def new_invoice(Node, amount):
+    invoice = Node.scheme.new_invoice(amount)
+    # PTLC payments are made to the invoice pubkey
+    return invoice, getattr(invoice, 'pubkey', invoice.payment_hash)
+
+
+# Both strategies return (rounds, parts sent, parts generated, peak locked balance), rounds is
+# None when the payment was given up.
+
+# Every round sends the parts which are missing, each one fails with probability `loss`.
+# Failed parts are replaced by unsent redundant parts of the same payment, then by top-ups.
+def pay_with_retry(Node, payer, rng, args):
+    amount = args.parts * 1000
+    invoice, target = new_invoice(Node, amount)
+    payment = payer.create_payment(target, amount, args.parts, args.redundancy)
+    retry = PaymentRetry(payer, payment)
+    peak_locked = payer.locked_balance
+    sent = 0
+    rounds = 0
+    while not retry.complete():
+        rounds += 1
+        if rounds > args.max_rounds:
+            payer.drop_payment(Node.scheme.payment_key(payment))
+            return None, sent, len(payment.parts), peak_locked
+        for index, _ in retry.dispatch():
+            sent += 1
+            if rng.random() < args.loss:
+                retry.failed(index)
+            else:
+                retry.delivered(index)
+        peak_locked = max(peak_locked, payer.locked_balance)
+    retry.reveal()
+    payer.drop_payment(Node.scheme.payment_key(payment))
+    return rounds, sent, len(payment.parts), peak_locked
+
+
+# Any failed part makes the payer pay again from scratch with a new payment, the parts
+# delivered by earlier attempts stay locked until the payment completes (their timeout).
+def pay_again(Node, payer, rng, args):
+    amount = args.parts * 1000
+    invoice, target = new_invoice(Node, amount)
+    peak_locked = payer.locked_balance
+    sent = generated = 0
+    attempts = []
+    rounds = 0
+    while True:
+        rounds += 1
+        if rounds > args.max_rounds:
+            for attempt in attempts:
+                payer.unlock_balance(attempt.locked_amount)
+            return None, sent, generated, peak_locked
+        payment = payer.create_payment(target, amount, args.parts, args.redundancy)
+        attempts.append(payment)
+        generated += len(payment.parts)
+        failed = sum(1 for _ in range(args.parts) if rng.random() < args.loss)
+        sent += args.parts
+        if failed:
+            payer.release_parts(payment, failed)
+        peak_locked = max(peak_locked, payer.locked_balance)
+        if not failed:
+            break
+        # the attempt is abandoned, a payer has one payment per key so it is dropped from the
+        # index but its delivered parts keep their amount locked
+        payer.drop_payment(Node.scheme.payment_key(payment))
+        payer.lock_balance(payment.locked_amount)
+    payer.reveal_parts(payment.parts[:args.parts])
+    for attempt in attempts[:-1]:
+        payer.unlock_balance(attempt.locked_amount)
+    payer.drop_payment(Node.scheme.payment_key(payment))
+    return rounds, sent, generated, peak_locked
+
+
+def run(args):
+    Node = node_class(args.variant)
+    results = {}
+    for name, strategy in (('retry', pay_with_retry), ('pay_again', pay_again)):
+        rng = random.Random(args.payments)
+        payer = quiet(Node())
+        payer.balance = args.parts * 1000 * (args.parts + args.redundancy) * args.max_rounds
+        rounds = []
+        incomplete = sent = generated = 0
+        locked = []
+        start = time.perf_counter()
+        for _ in range(args.payments):
+            r, s, g, peak = strategy(Node, payer, rng, args)
+            if r is None:
+                incomplete += 1
+            else:
+                rounds.append(r)
+            sent += s
+            generated += g
+            locked.append(peak / (args.parts * 1000))
+        elapsed = time.perf_counter() - start
+        if payer.locked_balance:
+            raise Exception(f"{payer.locked_balance} left locked")
+        results[f'{args.variant}/{name}'] = {
+            'ops': args.payments,
+            'ops_per_sec': args.payments / elapsed,
+            'incomplete': incomplete,
+            'rounds_mean': statistics.mean(rounds) if rounds else None,
+            'rounds_max': max(rounds) if rounds else None,
+            'parts_sent': sent,
+            'parts_generated': generated,
+            'locked_ratio_mean': statistics.mean(locked),
+            'locked_ratio_max': max(locked),
+        }
+    return results
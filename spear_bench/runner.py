@@ -0,0 +1,200 @@
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+# metrics where a bigger number is an improvement, everything else is "lower is better"
+HIGHER_IS_BETTER = {'ops_per_sec'}
+# metrics checked against a baseline
+COMPARED_METRICS = ('ops_per_sec', 'p50_ms', 'p99_ms', 'cpu_s', 'memory_mb')
+
+
+class NullWriter:
+    # swallow the debug output of nodes while measuring
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = round(q / 100 * (len(ordered) - 1))
+    return ordered[index]
+
+
+# peak resident set size of this process in KiB
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and KiB on Linux
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+# VmRSS and VmHWM (peak) of this process in KiB, None where there is no /proc
+def proc_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if line.startswith(('VmRSS:', 'VmHWM:')))
+    except OSError:
+        return None
+    return int(fields['VmRSS'].split()[0]), int(fields['VmHWM'].split()[0])
+
+
+# Reset the peak RSS of this process to its current RSS, so that the next peak is the peak
+# of what runs from now on. Only Linux can, return whether the peak was reset.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+class Phase:
+    # Measure one phase of a workload: wall clock and CPU time of the whole phase,
+    # plus the latency of every single operation and the peak RSS reached by the phase.
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.wall = 0.0
+        self.cpu = 0.0
+        # peak RSS during the phase and its growth over the RSS the phase started with, in
+        # KiB. Without a resettable peak (other than Linux) the peak is only known when the
+        # phase raised the peak of the process.
+        self.peak_rss = None
+        self.rss_growth = 0
+
+    def __enter__(self):
+        self._reset = reset_peak_rss()
+        rss = proc_rss_kb() if self._reset else None
+        self._rss_start = rss[0] if rss is not None else peak_rss_kb()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self._wall_start
+        self.cpu = time.process_time() - self._cpu_start
+        rss = proc_rss_kb() if self._reset else None
+        if rss is not None:
+            self.peak_rss = rss[1]
+        else:
+            peak = peak_rss_kb()
+            self.peak_rss = peak if peak > self._rss_start else None
+        self.rss_growth = max((self.peak_rss or 0) - self._rss_start, 0)
+        return False
+
+    # run a single operation and record its latency
+    def run(self, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def stats(self):
+        ops = len(self.latencies)
+        return {
+            'ops': ops,
+            'ops_per_sec': ops / self.wall if self.wall else 0.0,
+            'p50_ms': percentile(self.latencies, 50) * 1000,
+            'p99_ms': percentile(self.latencies, 99) * 1000,
+            'cpu_s': self.cpu,
+            'wall_s': self.wall,
+            'peak_rss_kb': self.peak_rss,
+            'rss_growth_kb': self.rss_growth,
+        }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(path, document):
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Compare current results with a baseline document.
+# Return a list of human readable regressions, a metric regresses when it is worse than
+# the baseline by more than `tolerance` (relative).
+def compare(baseline, current, tolerance):
+    regressions = []
+    base_results = baseline.get('results', {})
+    for key, metrics in current.get('results', {}).items():
+        base_metrics = base_results.get(key)
+        if base_metrics is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in metrics or metric not in base_metrics:
+                continue
+            old, new = base_metrics[metric], metrics[metric]
+            if not old:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                change = (old - new) / old
+            else:
+                change = (new - old) / old
+            if change > tolerance:
+                regressions.append(f"{key} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%} worse)")
+    return regressions
+
+
+# columns shown first, in this order, when a suite reports them
+COLUMNS = (('ops', 'ops', 8, '{}'), ('ops_per_sec', 'ops/s', 10, '{:.1f}'), ('p50_ms', 'p50 ms', 9, '{:.3f}'),
+           ('p99_ms', 'p99 ms', 9, '{:.3f}'), ('cpu_s', 'cpu s', 8, '{:.3f}'), ('peak_rss_kb', 'rss KiB', 9, '{}'),
+           ('rss_growth_kb', 'rss +KiB', 9, '{}'))
+# reported metrics which are not worth a column
+HIDDEN_METRICS = {'wall_s'}
+
+
+def format_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.1f}' if abs(value) >= 100 else f'{value:.3f}'
+    return str(value)
+
+
+# Results as a table, one row per workload. The common columns a suite doesn't report are
+# left out, every other metric a suite reports gets a column of its own after them.
+def format_table(results):
+    rows = list(results.values())
+    columns = [(metric, title, width, fmt.format) for metric, title, width, fmt in COLUMNS
+               if any(metric in metrics for metrics in rows)]
+    known = {metric for metric, _, _, _ in COLUMNS} | HIDDEN_METRICS
+    extras = []
+    for metrics in rows:
+        for metric, value in metrics.items():
+            if metric not in known and metric not in extras and not isinstance(value, (dict, list)):
+                extras.append(metric)
+    for metric in extras:
+        width = max([len(metric)] + [len(format_value(metrics.get(metric))) for metrics in rows])
+        columns.append((metric, metric, width, format_value))
+    name_width = max([28] + [len(key) for key in results])
+    lines = [f"{'workload':<{name_width}}" + ''.join(f" {title:>{width}}" for _, title, width, _ in columns)]
+    for key, metrics in results.items():
+        cells = []
+        for metric, _, width, fmt in columns:
+            value = fmt(metrics[metric]) if metrics.get(metric) is not None else '-'
+            cells.append(f" {value:>{width}}")
+        lines.append(f"{key:<{name_width}}" + ''.join(cells))
+    return '\n'.join(lines)
@@ -0,0 +1,81 @@
+import random
+import time
+
+from spear_bench.runner import percentile
+from spear_ptlc import schnorr, secp256k1
+
+NAME = 'schnorr'
+HELP = 'single vs batch Schnorr signature verification throughput'
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help='batch sizes (default: 1 10 100 1000, add 10000 for the large case)')
+    parser.add_argument('--keys', type=int, default=0,
+                        help='number of distinct signing keys, 0 means one key per signature')
+    parser.add_argument('--single-limit', type=int, default=50,
+                        help='verify at most this many signatures one by one and extrapolate the rate')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions per batch size')
+
+
+# Valid signatures generated cheaply: consecutive nonces and keys let R and P be computed
+# with one point addition each instead of a full multiplication. Never sign like this outside
+# of a benchmark.
+def make_signatures(count, keys, rng):
+    keys = keys or count
+    k = secp256k1.Fr(rng.randrange(1, secp256k1.N))
+    x0 = secp256k1.Fr(rng.randrange(1, secp256k1.N))
+    R = secp256k1.G * k
+    pubkeys = [secp256k1.G * x0]
+    prikeys = [x0]
+    for _ in range(1, min(keys, count)):
+        prikeys.append(prikeys[-1] + secp256k1.Fr(1))
+        pubkeys.append(pubkeys[-1] + secp256k1.G)
+    signatures = []
+    for i in range(count):
+        m = schnorr.hash_message(i.to_bytes(8, 'little'))
+        e = schnorr.challenge(R, m)
+        s = k + e * prikeys[i % len(prikeys)]
+        signatures.append((R, s, pubkeys[i % len(pubkeys)], m))
+        k = k + secp256k1.Fr(1)
+        R = R + secp256k1.G
+    return signatures
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = {}
+    for size in args.sizes:
+        signatures = make_signatures(size, args.keys, rng)
+
+        sample = signatures[:max(1, min(size, args.single_limit))]
+        latencies = []
+        for R, s, P, m in sample:
+            start = time.perf_counter()
+            if not schnorr.verify(R, s, P, m):
+                raise Exception("Invalid signature")
+            latencies.append(time.perf_counter() - start)
+        single_rate = len(latencies) / sum(latencies)
+
+        batch_latencies = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            if not schnorr.batch_verify(signatures):
+                raise Exception("Invalid signature batch")
+            batch_latencies.append(time.perf_counter() - start)
+        best = min(batch_latencies)
+
+        results[f'single/{size}'] = {
+            'ops': len(latencies),
+            'ops_per_sec': single_rate,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+        results[f'batch/{size}'] = {
+            'ops': size,
+            'ops_per_sec': size / best,
+            'p50_ms': percentile(batch_latencies, 50) * 1000,
+            'p99_ms': percentile(batch_latencies, 99) * 1000,
+            'speedup': size / best / single_rate,
+        }
+    return results
@@ -0,0 +1,53 @@
+import time
+
+from spear_bench.workloads import quiet
+from spear_core.shard import ShardedPayee
+
+NAME = 'shard'
+HELP = 'PTLC claim throughput of a payee sharded over worker processes'
+
+
+def add_arguments(parser):
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='shard counts (default: 1 2 4)')
+    parser.add_argument('--payments', type=int, default=8, help='payments claimed at once')
+    parser.add_argument('--parts', type=int, default=2, help='parts per payment')
+
+
+def run(args):
+    from spear_ptlc.node import Node
+
+    # payments are made once and replayed against every sharded payee
+    payer = quiet(Node())
+    invoices = []
+    claims = []
+    for _ in range(args.payments):
+        amount = args.parts * 1000
+        invoice = Node.scheme.new_invoice(amount)
+        payer.balance += amount
+        ptlcs = payer.pay(invoice.pubkey, amount, args.parts, 0)
+        invoices.append(invoice)
+        claims.append((ptlcs, payer.reveal_ptlcs(ptlcs)))
+
+    results = {}
+    base_rate = None
+    for shards in args.shards:
+        with ShardedPayee(Node, shards=shards) as payee:
+            for invoice in invoices:
+                payee.add_invoice(invoice)
+            for ptlcs, _ in claims:
+                payee.receive(ptlcs)
+            start = time.perf_counter()
+            claimed = payee.claim_many(claims)
+            elapsed = time.perf_counter() - start
+        failed = [result for result in claimed if isinstance(result, Exception)]
+        if failed:
+            raise Exception(f"{len(failed)} claim(s) failed on {shards} shard(s): {failed[0]}")
+        rate = args.payments / elapsed
+        base_rate = base_rate or rate
+        results[f'shards/{shards}'] = {
+            'ops': args.payments,
+            'ops_per_sec': rate,
+            'parts_per_sec': args.payments * args.parts / elapsed,
+            'speedup': rate / base_rate,
+        }
+    return results
@@ -0,0 +1,173 @@
+import contextlib
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from spear_bench.runner import NullWriter, Phase
+
+NAME = 'protocol'
+HELP = 'end to end payments over the three protocol variants'
+
+PHASES = ('pay', 'receive', 'reveal', 'claim')
+
+
+def quiet(node):
+    node.verbose = False
+    return node
+
+
+# Each workload adapts one protocol variant to the same four phases.
+# An "invoice" is whatever the payer needs from the payee to pay it.
+class SpearWorkload:
+    name = 'spear'
+
+    def node(self):
+        from spear.node import Node
+        return quiet(Node())
+
+    def new_invoice(self, payee, amount):
+        payment_hash, _ = payee.new_invoice(amount)
+        return payment_hash
+
+    def pay(self, payer, invoice, amount, parts_count, redundant_parts_count):
+        return payer.pay(invoice, amount, parts_count, redundant_parts_count)
+
+    def receive(self, payee, invoice, parts):
+        payee.receive_htlcs(parts)
+        return payee.get_received_htlcs(invoice)
+
+    def reveal(self, payer, received):
+        return payer.reveal_htlcs(received)
+
+    def claim(self, payee, received, secrets):
+        return payee.claim(received, secrets)
+
+
+class SimpleSpearWorkload(SpearWorkload):
+    name = 'simple_spear'
+
+    def node(self):
+        from simple_spear.node import Node
+        return quiet(Node())
+
+    def receive(self, payee, invoice, parts):
+        payee.receive_htlcs(parts)
+        return payee.get_received_htlcs(invoice, parts[0].set_id)
+
+
+class SpearPTLCWorkload:
+    name = 'spear_ptlc'
+
+    def node(self):
+        from spear_ptlc.node import Node
+        return quiet(Node())
+
+    def new_invoice(self, payee, amount):
+        payment_hash, pubkey, _ = payee.new_invoice(amount)
+        return payment_hash, pubkey
+
+    def pay(self, payer, invoice, amount, parts_count, redundant_parts_count):
+        return payer.pay(invoice[1], amount, parts_count, redundant_parts_count)
+
+    def receive(self, payee, invoice, parts):
+        payee.receive_ptlcs(parts)
+        return payee.get_received_ptlcs(invoice[0])
+
+    def reveal(self, payer, received):
+        return payer.reveal_ptlcs(received)
+
+    def claim(self, payee, received, secrets):
+        return payee.claim(received, secrets)
+
+
+WORKLOADS = {w.name: w for w in (SpearWorkload(), SimpleSpearWorkload(), SpearPTLCWorkload())}
+
+
+def add_arguments(parser):
+    parser.add_argument('--variant', action='append', choices=sorted(WORKLOADS),
+                        help='protocol variant to run, repeat for several (default: all)')
+    parser.add_argument('--payments', type=int, default=20, help='number of payments')
+    parser.add_argument('--parts', type=int, default=5, help='parts per payment')
+    parser.add_argument('--redundancy', type=int, default=2, help='redundant parts per payment')
+    parser.add_argument('--concurrency', type=int, default=1, help='worker threads per phase')
+    parser.add_argument('--nodes', type=int, default=1, help='number of payer/payee node pairs')
+
+
+class PaymentState:
+    def __init__(self, payer, payee, amount):
+        self.payer = payer
+        self.payee = payee
+        self.amount = amount
+        self.invoice = None
+        self.parts = None
+        self.forwarded = None
+        self.received = None
+        self.secrets = None
+
+
+# Run every payment through one phase, payments are spread over `concurrency` threads.
+# Nodes are not thread safe, so an operation holds the lock of the node it mutates.
+def run_phase(phase, states, op, concurrency):
+    def step(state):
+        phase.run(op, state)
+
+    if concurrency <= 1:
+        for state in states:
+            step(state)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # consume the iterator so that exceptions are raised
+        list(executor.map(step, states))
+
+
+def run_variant(workload, args, rng):
+    pairs = [(workload.node(), workload.node()) for _ in range(max(1, args.nodes))]
+    locks = {id(node): threading.Lock() for pair in pairs for node in pair}
+    # amount divisible by parts count to keep the float part amounts exact
+    amount = args.parts * 1000
+
+    states = []
+    for i in range(args.payments):
+        payer, payee = pairs[i % len(pairs)]
+        payer.balance += amount + amount / args.parts * args.redundancy
+        state = PaymentState(payer, payee, amount)
+        state.invoice = workload.new_invoice(payee, amount)
+        states.append(state)
+
+    def pay(state):
+        with locks[id(state.payer)]:
+            state.parts = workload.pay(state.payer, state.invoice, state.amount, args.parts, args.redundancy)
+
+    def receive(state):
+        with locks[id(state.payee)]:
+            state.received = workload.receive(state.payee, state.invoice, state.forwarded)
+        if not state.received:
+            raise Exception(f"{workload.name}: payee didn't receive enough parts")
+
+    def reveal(state):
+        with locks[id(state.payer)]:
+            state.secrets = workload.reveal(state.payer, state.received)
+
+    def claim(state):
+        with locks[id(state.payee)]:
+            workload.claim(state.payee, state.received, state.secrets)
+
+    results = {}
+    for name, op in zip(PHASES, (pay, receive, reveal, claim)):
+        if name == 'receive':
+            # simulate network forwarding, pick which parts reach the payee
+            for state in states:
+                state.forwarded = rng.sample(state.parts, args.parts)
+        with Phase(name) as phase:
+            run_phase(phase, states, op, args.concurrency)
+        results[f'{workload.name}/{name}'] = phase.stats()
+    return results
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = {}
+    with contextlib.redirect_stdout(NullWriter()):
+        for name in args.variant or WORKLOADS:
+            results.update(run_variant(WORKLOADS[name], args, rng))
+    return results
@@ -0,0 +1,12 @@
+# spear_core package, code shared by the protocol variants
+import importlib
+
+__all__ = ['engine', 'hashing', 'pipeline', 'profiling', 'rand', 'retention', 'retry', 'shard']
+
+
+# submodules are imported on first use (PEP 562), e.g. pipeline pulls in asyncio and shard
+# multiprocessing, which processes that don't use them shouldn't pay for
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
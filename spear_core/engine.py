@@ -0,0 +1,513 @@
+# Protocol engine shared by the Spear variants.
+#
+# The engine does everything which doesn't depend on the lock type: balance accounting,
+# indexing of invoices, payments and received parts, accumulation of parts until a payment
+# is complete, and the bookkeeping of reveal and claim.
+#
+# A variant plugs in its lock type with a LockScheme and a Payment subclass which knows how
+# to generate parts. The Node classes of the variants are thin adapters over this Node which
+# keep their historical method names (pay, reveal_htlcs, receive_ptlcs, ...).
+
+import array
+import collections.abc
+import itertools
+import operator
+import sys
+
+from spear_core import hashing, rand
+from spear_core import retention as _retention
+from spear_core.retention import estimate_size
+
+_amount = operator.attrgetter('amount')
+# bytes of a preimage index entry: a 32-byte part hash and a part index
+_index_entry_size = sys.getsizeof(bytes(32)) + sys.getsizeof(2 ** 20)
+
+
+class LockScheme:
+    # name of a locked part in messages, e.g. 'HTLC'
+    part_name = 'part'
+    # name of the secrets revealed by the payer, e.g. 'preimage'
+    secret_name = 'secret'
+
+    # payee: new invoice for amount
+    def new_invoice(self, amount):
+        raise NotImplementedError
+
+    # payer: new payment with its locked parts, `target` is what the payee handed out
+    # (payment hash or invoice pubkey)
+    def new_payment(self, target, amount, parts_count, redundant_parts_count):
+        raise NotImplementedError
+
+    # Keys are plain attribute getters so that the engine can map them over many parts
+    # at C speed, a scheme may replace them with any function of one argument.
+
+    # key of a payment in the payer index
+    payment_key = operator.attrgetter('payment_hash')
+    # key of the payment a part belongs to, must match payment_key
+    part_payment_key = operator.attrgetter('payment_hash')
+    # key grouping received parts of one payment on the payee side
+    group_key = operator.attrgetter('payment_hash')
+    # unique key of a part, used to drop duplicated parts
+    part_key = None
+    # whether group_key is the invoice payment hash, payees can only be sharded by payment
+    # hash when it is
+    groups_by_payment_hash = True
+
+    # payer: secret revealed for a part of a payment
+    def reveal(self, payment, part):
+        raise NotImplementedError
+
+    # payer: secrets revealed for parts of a payment
+    def reveal_all(self, payment, parts):
+        return [self.reveal(payment, part) for part in parts]
+
+    # payee: check the revealed secrets of parts, raise on failure and return the claim result
+    # `invoice` is None when the payee doesn't know the invoice of the parts
+    def verify_claim(self, node, invoice, parts, secrets):
+        raise NotImplementedError
+
+    # payee: verify several claims of (invoice, parts, secrets) at once, a scheme can
+    # override it to batch the work of all claims
+    def verify_claims(self, node, claims):
+        return [self.verify_claim(node, invoice, parts, secrets) for invoice, parts, secrets in claims]
+
+    # payee: payment proof of a claimed invoice as bytes, kept once the invoice is evicted,
+    # None when the scheme has no proof
+    def proof(self, invoice):
+        return None
+
+
+class Record:
+    # Light value object with __slots__. Parts and secrets are built on access as views of a
+    # payment, two records are equal when they have the same type and fields, so a view
+    # built twice compares equal to itself and can be looked up in a table.
+    __slots__ = ()
+
+    def _fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+
+class WireRecord(Record):
+    # Record sent over the wire packed with `wire_format`, a struct.Struct of its fields. The
+    # packed fields are the slots in order and the constructor takes them in the same order,
+    # a record with fields which need their own encoding overrides _wire_fields and
+    # _from_fields.
+    __slots__ = ()
+    wire_format = None
+
+    def _wire_fields(self):
+        return self._fields()
+
+    # records from unpacked wire fields
+    @classmethod
+    def _from_fields(cls, fields):
+        return list(itertools.starmap(cls, fields))
+
+    def encode(self):
+        return self.wire_format.pack(*self._wire_fields())
+
+    @classmethod
+    def decode(cls, data):
+        return cls._from_fields([cls.wire_format.unpack(data)])[0]
+
+    @classmethod
+    def decode_batch(cls, datas):
+        return cls._from_fields(map(cls.wire_format.unpack, datas))
+
+    # parse a buffer of concatenated encoded records
+    @classmethod
+    def decode_buffer(cls, buffer):
+        return cls._from_fields(cls.wire_format.iter_unpack(buffer))
+
+
+class TableView(collections.abc.Sequence):
+    # Read only view of a PartTable, items are built on access by `view(index)`, e.g. the
+    # payer secret of every part.
+    def __init__(self, table, view):
+        self.table = table
+        self.view = view
+
+    def __len__(self):
+        return len(self.table.amounts)
+
+    def __getitem__(self, index):
+        count = len(self.table.amounts)
+        if isinstance(index, slice):
+            return list(map(self.view, range(*index.indices(count))))
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("part index out of range")
+        return self.view(index)
+
+    def __iter__(self):
+        return map(self.view, range(len(self.table.amounts)))
+
+
+class PartTable(TableView):
+    # Parts of a payment stored column by column instead of one object per part: amounts in
+    # an array of doubles and the 32-byte hash of every part in one buffer. Parts are built
+    # on access as light view objects by `view(index)`, so the table reads like a list of
+    # parts.
+    hash_size = 32
+
+    def __init__(self, view):
+        super().__init__(self, view)
+        self.amounts = array.array('d')
+        self.hashes = bytearray()
+
+    # append parts of `amounts`, `hashes` is the concatenated hash of every part (it may be
+    # empty for parts without a hash)
+    def extend(self, amounts, hashes=b''):
+        self.amounts.extend(amounts)
+        self.hashes += hashes
+
+    def hash(self, index):
+        start = index * self.hash_size
+        return bytes(self.hashes[start:start + self.hash_size])
+
+    def nbytes(self):
+        return len(self.amounts) * self.amounts.itemsize + len(self.hashes)
+
+
+class Payment:
+    # Payer side state of a payment. Subclasses generate the locked parts in add_parts, append
+    # them to the self.parts table and build the part views in part(index).
+    def __init__(self, payment_hash, amount, parts_count, redundant_parts_count):
+        self.payment_hash = payment_hash
+        self.amount = amount
+        self.amount_per_part = amount / parts_count
+        self.locked_amount = amount + self.amount_per_part * redundant_parts_count
+        self.parts_count = parts_count
+        self.redundant_parts_count = redundant_parts_count
+        self.parts = PartTable(self.part)
+        # parts of the last reveal, in the order the secrets were returned
+        self.revealed = []
+        self.add_parts(parts_count + redundant_parts_count)
+
+    def add_parts(self, count):
+        raise NotImplementedError
+
+    # view of the part at index
+    def part(self, index):
+        raise NotImplementedError
+
+    # estimated bytes of the containers growing with the parts, on top of estimate_size(payment)
+    def nbytes(self):
+        return self.parts.nbytes() + sys.getsizeof(self.revealed)
+
+
+class HashLockPayment(Payment):
+    # Payment of an HTLC variant: every part is locked by the SHA-256 hash of its own random
+    # 32-byte secret. The secrets are kept in one buffer, the hashes in the hash column of the
+    # part table and the index maps a part hash back to its part.
+    def __init__(self, payment_hash, amount, parts_count, redundant_parts_count):
+        # secrets of all parts, 32 bytes each
+        self.secrets = bytearray()
+        # part hash -> part index
+        self.preimage_index = {}
+        super().__init__(payment_hash, amount, parts_count, redundant_parts_count)
+
+    def add_parts(self, count):
+        start = len(self.parts)
+        secrets = rand.random_bytes(32 * count)
+        hashes = hashing.sha256_batch([secrets[i:i + 32] for i in range(0, len(secrets), 32)])
+        self.secrets += secrets
+        self.preimage_index.update(zip(hashes, range(start, start + count)))
+        self.parts.extend(itertools.repeat(self.amount_per_part, count), b''.join(hashes))
+
+    # secret of the part at index
+    def secret(self, index):
+        return bytes(self.secrets[index * 32:index * 32 + 32])
+
+    def nbytes(self):
+        return super().nbytes() + sys.getsizeof(self.secrets) + sys.getsizeof(self.preimage_index) \
+            + len(self.preimage_index) * _index_entry_size
+
+
+class HashLockScheme(LockScheme):
+    # Scheme of HashLockPayment parts, `part_key` is the attribute getter of the per part hash.
+
+    def reveal(self, payment, part):
+        index = payment.preimage_index.get(self.part_key(part))
+        if index is None:
+            raise Exception("Payer preimage not found")
+        return payment.secret(index)
+
+
+class ReceivedParts:
+    # Payee side accumulator of the parts of one payment, in arrival order.
+    def __init__(self):
+        self.parts = []
+        self.amount = 0
+        # invoice the parts were matched with by get_received_parts
+        self.invoice = None
+        # set once the parts have been handed out as a complete payment
+        self.complete = False
+        self.claimed = False
+
+    def add(self, part):
+        self.parts.append(part)
+        self.amount += part.amount
+
+
+class Node:
+    scheme = None
+
+    def __init__(self):
+        self.balance = 0
+        self.locked_balance = 0
+        # payment key -> payment
+        self.payments = {}
+        # payment hash -> invoice
+        self.invoices = {}
+        # group key -> ReceivedParts
+        self.received = {}
+        self.received_keys = set()
+        # group keys of settled payments, late parts of a settled payment are dropped
+        self.settled = set()
+        # print progress messages
+        self.verbose = True
+        # spear_core.retention.Retention evicting settled and stale state, None keeps everything
+        self.retention = None
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    # lock balance
+    def lock_balance(self, amount):
+        if self.balance < amount:
+            raise Exception("Insufficient balance")
+        self.balance -= amount
+        self.locked_balance += amount
+
+    # unlock balance
+    def unlock_balance(self, amount):
+        if self.locked_balance < amount:
+            raise Exception("Insufficient locked balance")
+        self.locked_balance -= amount
+        self.balance += amount
+
+    # payee create new invoice
+    def create_invoice(self, amount):
+        invoice = self.scheme.new_invoice(amount)
+        self.add_invoice(invoice)
+        return invoice
+
+    def add_invoice(self, invoice):
+        self.invoices[invoice.payment_hash] = invoice
+        if self.retention is not None:
+            self.retention.track(self, _retention.INVOICE, invoice.payment_hash, estimate_size(invoice))
+
+    def find_invoice(self, payment_hash):
+        return self.invoices.get(payment_hash)
+
+    # payer gen redundant payment parts and lock the whole amount
+    # a payer has at most one payment per key, a second payment would leave the lock of the
+    # first one unreachable
+    def create_payment(self, target, amount, parts_count, redundant_parts_count):
+        payment = self.scheme.new_payment(target, amount, parts_count, redundant_parts_count)
+        key = self.scheme.payment_key(payment)
+        if key in self.payments:
+            raise Exception("Payment already exists")
+        self.lock_balance(payment.locked_amount)
+        self.payments[key] = payment
+        if self.retention is not None:
+            size = estimate_size(payment) + payment.nbytes()
+            self.retention.track(self, _retention.PAYMENT, key, size)
+        return payment
+
+    def find_payment(self, key):
+        return self.payments.get(key)
+
+    # payer add `count` parts to a payment and lock their amount
+    def top_up_payment(self, payment, count):
+        amount = payment.amount_per_part * count
+        self.lock_balance(amount)
+        size = payment.nbytes()
+        payment.add_parts(count)
+        payment.locked_amount += amount
+        payment.redundant_parts_count += count
+        if self.retention is not None:
+            self.retention.track(self, _retention.PAYMENT, self.scheme.payment_key(payment), payment.nbytes() - size)
+
+    # payer release the lock of `count` parts of a payment which failed to be delivered,
+    # failed parts can't be claimed any more
+    def release_parts(self, payment, count):
+        amount = payment.amount_per_part * count
+        self.unlock_balance(amount)
+        payment.locked_amount -= amount
+
+    # Forget a payment and release its locked balance: what was locked above the paid amount
+    # if its parts were revealed, all of it otherwise.
+    def drop_payment(self, key):
+        payment = self.payments.pop(key, None)
+        if payment is None:
+            return None
+        if payment.revealed:
+            self.locked_balance -= payment.amount
+            self.unlock_balance(payment.locked_amount - payment.amount)
+        else:
+            self.unlock_balance(payment.locked_amount)
+        return payment
+
+    # payer reveal secrets of payment parts to payee
+    def reveal_parts(self, parts):
+        scheme = self.scheme
+        # all parts should be from the same payment
+        keys = set(map(scheme.part_payment_key, parts))
+        if len(keys) > 1:
+            raise Exception(f"{scheme.part_name}s are from different payments")
+
+        payment = self.payments.get(keys.pop()) if keys else None
+        if payment is None:
+            raise Exception("Payment not found")
+
+        # check total amount of parts
+        total_amount = sum(map(_amount, parts))
+        if total_amount != payment.amount:
+            raise Exception(f"Reject to reveal {scheme.part_name.lower()}s because of invalid amount {total_amount} != {payment.amount}")
+
+        secrets = scheme.reveal_all(payment, parts)
+        payment.revealed = list(parts)
+        return secrets
+
+    # payee receive locked parts
+    def receive_parts(self, parts):
+        for part in parts:
+            self.receive_part(part)
+
+    # add one received part to its payment
+    # return the ReceivedParts of the payment, None if the part is a duplicate
+    def receive_part(self, part):
+        scheme = self.scheme
+        # deduplicate parts
+        key = scheme.part_key(part)
+        if key in self.received_keys:
+            return None
+        group = scheme.group_key(part)
+        if group in self.settled:
+            return None
+        self.received_keys.add(key)
+        received = self.received.get(group)
+        if received is None:
+            received = self.received[group] = ReceivedParts()
+        received.add(part)
+        if self.retention is not None:
+            self.retention.track(self, _retention.RECEIVED, group, estimate_size(part))
+        return received
+
+    # all received parts, in arrival order per payment
+    def received_parts(self):
+        return [part for received in self.received.values() for part in received.parts]
+
+    # return parts which pay the invoice or None if not enough parts
+    # parts are grouped by `group_key`, which defaults to the payment hash
+    def get_received_parts(self, payment_hash, group_key=None):
+        invoice = self.invoices.get(payment_hash)
+        if invoice is None:
+            return None
+        received = self.received.get(payment_hash if group_key is None else group_key)
+        total_amount = received.amount if received is not None else 0
+        # check if enough parts
+        if total_amount < invoice.amount:
+            self.log(f"Not enough {self.scheme.part_name.lower()}s, total amount: {total_amount}, invoice amount: {invoice.amount}")
+            return None
+
+        parts = []
+        total_amount = 0
+        for part in received.parts:
+            parts.append(part)
+            total_amount += part.amount
+            if total_amount == invoice.amount:
+                break
+            # assume parts amount is fixed
+            if total_amount > invoice.amount:
+                raise Exception("Invalid payment amount")
+        received.invoice = invoice
+        return parts
+
+    # received parts and invoice of the payment parts belong to
+    def _claim_target(self, parts, secrets):
+        # check secrets count
+        if len(secrets) != len(parts):
+            raise Exception(f"Invalid {self.scheme.secret_name}s count")
+        group = self.scheme.group_key(parts[0])
+        received = self.received.get(group)
+        invoice = received.invoice if received is not None else None
+        if invoice is None:
+            invoice = self.invoices.get(group)
+        return received, invoice
+
+    # payee verify revealed secrets and claim the payment
+    def claim_parts(self, parts, secrets):
+        received, invoice = self._claim_target(parts, secrets)
+        result = self.scheme.verify_claim(self, invoice, parts, secrets)
+
+        # Claim payment
+        self.log("Claim payment")
+        self._claimed(parts, received, invoice)
+        return result
+
+    def _claimed(self, parts, received, invoice):
+        if received is not None:
+            received.claimed = True
+        # claimed payments are settled right away when the node has a retention
+        if self.retention is not None and invoice is not None:
+            self.settle(self.scheme.group_key(parts[0]), invoice.payment_hash)
+
+    # Claim several payments given as (parts, secrets), the scheme verifies them in one batch.
+    # Return the claim result of each payment, or the exception a payment failed with.
+    def claim_many(self, claims):
+        try:
+            targets = [self._claim_target(parts, secrets) for parts, secrets in claims]
+            results = self.scheme.verify_claims(
+                self, [(invoice, parts, secrets) for (_, invoice), (parts, secrets) in zip(targets, claims)])
+        except Exception:
+            # find out which payments failed one by one
+            results = []
+            for parts, secrets in claims:
+                try:
+                    results.append(self.claim_parts(parts, secrets))
+                except Exception as e:
+                    results.append(e)
+            return results
+        for (received, invoice), (parts, _) in zip(targets, claims):
+            self.log("Claim payment")
+            self._claimed(parts, received, invoice)
+        return results
+
+    # Forget a claimed payment: its received parts, their dedup keys and its invoice. The
+    # group key is kept as a tombstone, late parts of the payment are dropped by receive_part
+    # instead of starting a new group. With a retention the tombstone is an entry of its own
+    # which expires or is evicted like the others. `tombstone=False` is for callers which
+    # reject parts of unknown invoices themselves.
+    # Return the invoice, None if there is none.
+    def settle(self, group_key, payment_hash=None, tombstone=True):
+        self.drop_received(group_key)
+        invoice = self.invoices.pop(group_key if payment_hash is None else payment_hash, None)
+        if self.retention is not None:
+            self.retention.settled(self, group_key, invoice)
+        if tombstone:
+            self.settled.add(group_key)
+            if self.retention is not None:
+                self.retention.track(self, _retention.TOMBSTONE, group_key, estimate_size(group_key))
+        return invoice
+
+    # Forget the received parts of a payment and their dedup keys.
+    def drop_received(self, group_key):
+        received = self.received.pop(group_key, None)
+        if received is not None:
+            part_key = self.scheme.part_key
+            for part in received.parts:
+                self.received_keys.discard(part_key(part))
+        return received
@@ -0,0 +1,62 @@
+import hashlib
+import itertools
+import os
+import sys
+import threading
+
+# Batched SHA-256.
+#
+# hashlib releases the GIL only for inputs of at least 2048 bytes, 32-byte preimages are
+# hashed with the GIL held. A thread pool therefore only pays off for large inputs or on a
+# free-threaded interpreter, smaller batches are hashed in one tight loop.
+
+# input size from which hashlib releases the GIL
+GIL_RELEASE_SIZE = 2048
+# batches smaller than this are never split across threads
+PARALLEL_MIN_ITEMS = 4096
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def _pool(workers):
+    global _executor
+    # concurrent.futures is slow to import and most processes never need the pool
+    from concurrent.futures import ThreadPoolExecutor
+    with _executor_lock:
+        if _executor is None or _executor._max_workers < workers:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sha256')
+        return _executor
+
+
+def _gil_enabled():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+
+def _digests(datas):
+    sha256 = hashlib.sha256
+    return [sha256(data).digest() for data in datas]
+
+
+def sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+# raw 32-byte digests of all datas, in order
+def sha256_batch(datas, workers=None):
+    datas = datas if isinstance(datas, list) else list(datas)
+    if len(datas) < PARALLEL_MIN_ITEMS:
+        return _digests(datas)
+    workers = default_workers() if workers is None else workers
+    if workers <= 1:
+        return _digests(datas)
+    if _gil_enabled() and min(map(len, datas)) < GIL_RELEASE_SIZE:
+        return _digests(datas)
+    size = -(-len(datas) // workers)
+    chunks = [datas[i:i + size] for i in range(0, len(datas), size)]
+    return list(itertools.chain.from_iterable(_pool(workers).map(_digests, chunks)))
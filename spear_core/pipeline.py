@@ -0,0 +1,192 @@
+import asyncio
+
+# Streaming ingestion of payment parts on the payee side.
+#
+# Parts flow through four stages, each one a generator over the previous one:
+#
+#   decode      wire encoded batches -> parts
+#   accept      drop duplicated parts and parts which can't pay a known invoice
+#   accumulate  add parts to their payment, emit payments once they are complete
+#   claim       ask the payer to reveal secrets and claim completed payments in micro-batches
+#
+# `Pipeline.run` chains them for a plain iterable of batches, pulling one batch at a time.
+# `Pipeline.run_async` runs the stages as asyncio tasks connected by bounded queues: a full
+# queue blocks the stage in front of it, so a fast source can't grow memory without bound.
+#
+# Claimed payments are settled (their parts, dedup keys and invoice are dropped from the node)
+# unless `settle=False`, so the node state only holds payments still in flight.
+
+# end of stream marker between async stages
+_DONE = object()
+
+
+class PipelineStats:
+    def __init__(self):
+        self.batches = 0
+        self.parts = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.completed = 0
+        self.claimed = 0
+        self.failed = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class Pipeline:
+    # node      payee node
+    # decode    function turning one item of the stream into a list of parts, e.g.
+    #           HTLC.decode_buffer, None when the stream already yields lists of parts
+    # reveal    function returning the payer secrets of the parts of a payment
+    # resolve   function returning the invoice payment hash of a part, defaults to the group
+    #           key of the scheme (the payment hash for spear and spear_ptlc)
+    def __init__(self, node, reveal, decode=None, resolve=None, batch_size=64, queue_size=64,
+                 max_delay=0.01, settle=True):
+        self.node = node
+        self.scheme = node.scheme
+        self.reveal = reveal
+        self.decode = decode
+        self.resolve = resolve or self.scheme.group_key
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_delay = max_delay
+        self.settle = settle
+        self.stats = PipelineStats()
+
+    def decoded(self, stream):
+        for item in stream:
+            self.stats.batches += 1
+            parts = item if self.decode is None else self.decode(item)
+            self.stats.parts += len(parts)
+            yield from parts
+
+    # yield (invoice, part) for new parts with a valid amount for a known invoice
+    def accepted(self, parts):
+        part_key = self.scheme.part_key
+        received_keys = self.node.received_keys
+        invoices = self.node.invoices
+        resolve = self.resolve
+        stats = self.stats
+        for part in parts:
+            if part_key(part) in received_keys:
+                stats.duplicates += 1
+                continue
+            invoice = invoices.get(resolve(part))
+            if invoice is None or not 0 < part.amount <= invoice.amount:
+                stats.rejected += 1
+                continue
+            yield invoice, part
+
+    # yield (invoice, parts) once the parts of a payment pay its invoice
+    def completed(self, accepted):
+        node = self.node
+        group_key = self.scheme.group_key
+        for invoice, part in accepted:
+            received = node.receive_part(part)
+            if received is None or received.complete or received.amount < invoice.amount:
+                continue
+            group = group_key(part)
+            try:
+                parts = node.get_received_parts(invoice.payment_hash, group)
+            except Exception:
+                # e.g. parts overshooting the invoice amount, the payment is dropped but the
+                # stream goes on
+                self.stats.rejected += 1
+                node.drop_received(group)
+                continue
+            if parts is None:
+                continue
+            received.complete = True
+            self.stats.completed += 1
+            yield invoice, parts
+
+    # Claim a micro-batch of completed payments, yield (invoice, parts, result) where result is
+    # the claim result or the exception the reveal or the claim failed with. The parts of a
+    # failed payment are dropped.
+    def claim_batch(self, batch):
+        revealed = []
+        results = [None] * len(batch)
+        for index, (_, parts) in enumerate(batch):
+            try:
+                revealed.append((index, (parts, self.reveal(parts))))
+            except Exception as e:
+                results[index] = e
+        claimed = self.node.claim_many([claim for _, claim in revealed]) if revealed else []
+        for (index, _), result in zip(revealed, claimed):
+            results[index] = result
+        group_key = self.scheme.group_key
+        for (invoice, parts), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.stats.failed += 1
+                self.node.drop_received(group_key(parts[0]))
+            else:
+                self.stats.claimed += 1
+                if self.settle:
+                    # no tombstone, accepted() drops late parts as parts of an unknown invoice
+                    self.node.settle(group_key(parts[0]), invoice.payment_hash, tombstone=False)
+            yield invoice, parts, result
+
+    def claimed(self, completed):
+        batch = []
+        for item in completed:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield from self.claim_batch(batch)
+                batch = []
+        if batch:
+            yield from self.claim_batch(batch)
+
+    def run(self, stream):
+        return self.claimed(self.completed(self.accepted(self.decoded(stream))))
+
+    # Async version of run, `source` is an iterable or async iterable of stream items.
+    # Yields (invoice, parts, result) like run. A micro-batch is claimed when it is full or
+    # when no payment completed for `max_delay` seconds.
+    async def run_async(self, source):
+        parts_queue = asyncio.Queue(self.queue_size)
+        completed_queue = asyncio.Queue(self.queue_size * self.batch_size)
+
+        async def decode_stage():
+            try:
+                if hasattr(source, '__aiter__'):
+                    async for item in source:
+                        await parts_queue.put(list(self.decoded([item])))
+                else:
+                    for item in source:
+                        await parts_queue.put(list(self.decoded([item])))
+            finally:
+                await parts_queue.put(_DONE)
+
+        async def accumulate_stage():
+            try:
+                while True:
+                    parts = await parts_queue.get()
+                    if parts is _DONE:
+                        break
+                    for item in self.completed(self.accepted(parts)):
+                        await completed_queue.put(item)
+            finally:
+                await completed_queue.put(_DONE)
+
+        tasks = [asyncio.create_task(decode_stage()), asyncio.create_task(accumulate_stage())]
+        try:
+            done = False
+            while not done:
+                batch = []
+                item = await completed_queue.get()
+                while item is not _DONE:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = await asyncio.wait_for(completed_queue.get(), self.max_delay)
+                    except asyncio.TimeoutError:
+                        break
+                done = item is _DONE
+                for result in self.claim_batch(batch):
+                    yield result
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,234 @@
+import contextlib
+import functools
+import hashlib
+import io
+import os
+import threading
+import time
+
+# Instrumentation of node operations and curve primitives.
+#
+# Modules register the functions they want to expose with `register`. Nothing is wrapped
+# until collection is enabled: `enable` swaps the registered attributes for counting/timing
+# wrappers and `disable` puts the original functions back, so there is no cost at all when
+# collection is off.
+#
+# Collection is turned on with `collecting()`:
+#
+#     with profiling.collecting():
+#         payee.claim(ptlcs, secrets)
+#     print(profiling.snapshot())
+#
+# or for the whole process with the environment variable SPEAR_PROFILE=1.
+
+TIMER = 'timer'
+COUNTER = 'counter'
+
+_lock = threading.Lock()
+_hooks = []
+_originals = {}
+_counters = {}
+_timers = {}
+_enabled = False
+
+
+class Timer:
+    # Call count, total time and a log2 histogram of durations in nanoseconds.
+    # Bucket i holds durations in [2^(i-1), 2^i) ns so memory stays bounded.
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = {}
+
+    def add(self, duration_ns):
+        bucket = duration_ns.bit_length()
+        with _lock:
+            self.count += 1
+            self.total_ns += duration_ns
+            if duration_ns > self.max_ns:
+                self.max_ns = duration_ns
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    # approximate percentile, upper bound of the bucket which contains it
+    def percentile_ns(self, q):
+        target = self.count * q / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min(1 << bucket, self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total_ns / 1e6,
+            'mean_ms': self.total_ns / self.count / 1e6 if self.count else 0.0,
+            'p50_ms': self.percentile_ns(50) / 1e6,
+            'p99_ms': self.percentile_ns(99) / 1e6,
+            'max_ms': self.max_ns / 1e6,
+            'histogram': {f'<{1 << bucket}ns': n for bucket, n in sorted(self.buckets.items())},
+        }
+
+
+def _count(name):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + 1
+
+
+def _timed(fn, name):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timer = _timers.get(name)
+            if timer is None:
+                timer = _timers.setdefault(name, Timer())
+            timer.add(time.perf_counter_ns() - start)
+    return wrapper
+
+
+def _counted(fn, name):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        _count(name)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _install(owner, attr, name, kind):
+    key = (id(owner), attr)
+    if key in _originals:
+        return
+    original = owner.__dict__[attr] if isinstance(owner, type) else getattr(owner, attr)
+    _originals[key] = (owner, attr, original)
+    wrap = _timed if kind == TIMER else _counted
+    setattr(owner, attr, wrap(original, name))
+
+
+# Register `owner.attr` (a class or module attribute) under `name`.
+# Timers record call counts and durations, counters only record call counts and are
+# meant for hot primitives.
+def register(owner, attr, name, kind=TIMER):
+    _hooks.append((owner, attr, name, kind))
+    if _enabled:
+        _install(owner, attr, name, kind)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+    for hook in _hooks:
+        _install(*hook)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    for owner, attr, original in _originals.values():
+        setattr(owner, attr, original)
+    _originals.clear()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+# Collect counters and timings inside the `with` block.
+@contextlib.contextmanager
+def collecting(reset_stats=True):
+    was_enabled = _enabled
+    if reset_stats:
+        reset()
+    enable()
+    try:
+        yield
+    finally:
+        if not was_enabled:
+            disable()
+
+
+# Counters include the call count of every timer, so `scalar_mul` shows up as a counter too.
+def snapshot():
+    with _lock:
+        timers = list(_timers.items())
+        counters = dict(_counters)
+    for name, timer in timers:
+        counters[name] = timer.count
+    return {
+        'counters': dict(sorted(counters.items())),
+        'timings': {name: timer.summary() for name, timer in sorted(timers)},
+    }
+
+
+def format_snapshot(snap):
+    lines = [f"{'counter':<40} {'calls':>10} {'total ms':>10} {'p50 ms':>9} {'p99 ms':>9}"]
+    for name, calls in snap['counters'].items():
+        timing = snap['timings'].get(name)
+        if timing is None:
+            lines.append(f"{name:<40} {calls:>10}")
+        else:
+            lines.append(f"{name:<40} {calls:>10} {timing['total_ms']:>10.3f} "
+                         f"{timing['p50_ms']:>9.4f} {timing['p99_ms']:>9.4f}")
+    return '\n'.join(lines)
+
+
+class HotspotReport:
+    def __init__(self, backend):
+        self.backend = backend
+        self.text = ''
+
+
+# Capture hotspots of the `with` block with cProfile or pyinstrument (if installed).
+# The report text is available on the yielded object after the block, `path` also saves
+# the raw profile (pstats dump for cProfile, HTML for pyinstrument).
+@contextlib.contextmanager
+def hotspots(backend='cprofile', path=None, limit=25):
+    report = HotspotReport(backend)
+    if backend == 'cprofile':
+        # profilers are only imported when used, they are slow to import
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield report
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+            report.text = out.getvalue()
+            if path:
+                profiler.dump_stats(path)
+    elif backend == 'pyinstrument':
+        try:
+            import pyinstrument
+        except ImportError:
+            raise Exception("pyinstrument is not installed")
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield report
+        finally:
+            profiler.stop()
+            report.text = profiler.output_text()
+            if path:
+                with open(path, 'w') as f:
+                    f.write(profiler.output_html())
+    else:
+        raise Exception(f"Unknown profiler backend {backend}")
+
+
+register(hashlib, 'sha256', 'sha256', COUNTER)
+
+if os.environ.get('SPEAR_PROFILE', '') not in ('', '0'):
+    enable()
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+
+# Randomness for secrets, preimages and scalars.
+#
+# Random bytes are drawn from os.urandom in large blocks and handed out as slices of the
+# block, which avoids one system call per secret. `take` returns zero-copy memoryviews of
+# the block for other sizes.
+#
+# `seed(value)` (or the environment variable SPEAR_SEED) switches to a deterministic stream
+# (SHAKE-256 of the seed and a block counter) for reproducible benchmarks and simulations.
+# Seeded output is predictable, never use it for real secrets.
+
+BLOCK_SIZE = 16 * 1024
+# size of secrets and scalars
+CHUNK_SIZE = 32
+
+
+class RandomPool:
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+        self._forks = 0
+        self.reseed(seed)
+
+    def reseed(self, seed=None):
+        with self._lock:
+            self.seed = seed
+            self._key = None if seed is None else hashlib.sha256(repr(seed).encode()).digest()
+            self._counter = 0
+            self._block = memoryview(b'')
+            self._pos = 0
+            self._generation += 1
+
+    def _draw(self, size):
+        if self._key is None:
+            return os.urandom(size)
+        block = hashlib.shake_256(self._key + self._counter.to_bytes(8, 'little')).digest(size)
+        self._counter += 1
+        return block
+
+    # 32-byte secrets are the common case: a whole block is split at once and handed out
+    # chunk by chunk. Every thread has its own chunks, so next() needs no lock: a shared
+    # iterator could hand the same chunk, i.e. the same secret, to two threads on
+    # free-threaded builds. Chunks of an older seed (generation) are dropped.
+    def _chunk(self):
+        local = self._local
+        if getattr(local, 'generation', None) == self._generation:
+            chunk = next(local.chunks, None)
+            if chunk is not None:
+                return chunk
+        with self._lock:
+            block = self._draw(self.block_size)
+            local.generation = self._generation
+        local.chunks = iter([block[i:i + CHUNK_SIZE] for i in range(0, len(block), CHUNK_SIZE)])
+        return next(local.chunks)
+
+    # zero-copy view of the next n random bytes
+    def take(self, n):
+        with self._lock:
+            if self._pos + n > len(self._block):
+                self._block = memoryview(self._draw(max(n, self.block_size)))
+                self._pos = 0
+            view = self._block[self._pos:self._pos + n]
+            self._pos += n
+        return view
+
+    def random_bytes(self, n=CHUNK_SIZE):
+        if n == CHUNK_SIZE:
+            return self._chunk()
+        return self.take(n).tobytes()
+
+    def randbits(self, k):
+        if k <= CHUNK_SIZE * 8:
+            value = int.from_bytes(self._chunk(), 'little')
+            return value >> (CHUNK_SIZE * 8 - k)
+        return int.from_bytes(self.take((k + 7) // 8), 'little') >> (-k % 8)
+
+    # uniform integer in [0, n), by rejection so that there is no modulo bias
+    def randbelow(self, n):
+        k = n.bit_length()
+        while True:
+            value = self.randbits(k)
+            if value < n:
+                return value
+
+    # uniform non-zero scalar modulo n
+    def random_scalar(self, n):
+        while True:
+            value = self.randbelow(n)
+            if value:
+                return value
+
+    # A forked child must not hand out the bytes buffered by its parent.
+    # Seeded pools derive a new key from the fork count, so runs stay reproducible.
+    def _before_fork(self):
+        self._forks += 1
+
+    def _after_fork_in_child(self):
+        self._lock = threading.Lock()
+        self._block = memoryview(b'')
+        self._pos = 0
+        self._local = threading.local()
+        if self._key is not None:
+            self._key = hashlib.sha256(self._key + b'fork' + self._forks.to_bytes(8, 'little')).digest()
+            self._counter = 0
+
+
+_pool = RandomPool(os.environ.get('SPEAR_SEED') or None)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_pool._before_fork, after_in_child=_pool._after_fork_in_child)
+
+
+# reseed the shared pool, None goes back to os.urandom
+def seed(value=None):
+    _pool.reseed(value)
+
+
+def take(n):
+    return _pool.take(n)
+
+
+def random_bytes(n=32):
+    return _pool.random_bytes(n)
+
+
+def randbits(k):
+    return _pool.randbits(k)
+
+
+def randbelow(n):
+    return _pool.randbelow(n)
+
+
+def random_scalar(n):
+    return _pool.random_scalar(n)
@@ -0,0 +1,196 @@
+import collections
+import collections.abc
+import math
+import sys
+import time
+
+from spear_core import profiling
+
+# Retention of node state.
+#
+# Without retention a node keeps every invoice, payment and received part forever. A
+# Retention attached to a node (node.retention = Retention(...)) tracks those entries in
+# least recently used order and evicts them when
+#
+#   - they are settled: a claimed payment is dropped right away, its payment proof is kept
+#     in a compact archive (payment hash -> proof bytes) and its group key as a tombstone
+#     entry which drops late parts of the payment until it expires or is evicted
+#   - they expire: no activity for `ttl` seconds, e.g. parts of a payment which never
+#     completed or an invoice which was never paid
+#   - the node holds more than `max_entries` entries or `max_bytes` estimated bytes, the
+#     least recently used entries go first
+#
+# Evicting a payer payment releases its locked balance: the paid amount when it was
+# revealed, the whole locked amount otherwise (the parts timed out).
+
+INVOICE = 'invoice'
+PAYMENT = 'payment'
+RECEIVED = 'received'
+# group key of a settled payment, kept to drop its late parts
+TOMBSTONE = 'tombstone'
+
+SETTLED = 'settled'
+EXPIRED = 'expired'
+EVICTED = 'evicted'
+
+# fixed size of objects by type: the object, its __dict__ and its scalar fields
+_sizes = {}
+
+
+# containers grow with the object, their size is not part of the fixed size of its type
+def _fixed(value):
+    return isinstance(value, (bytes, str)) or not isinstance(value, collections.abc.Sized)
+
+
+# Estimated size of an object without the containers it holds (lists, dicts, bytearrays,
+# part tables, ...). Fields of a type have the same size from one object to the next, so
+# the size is computed once per type, objects holding containers add them on top (see
+# engine.Payment.nbytes).
+def estimate_size(obj):
+    size = _sizes.get(type(obj))
+    if size is None:
+        size = sys.getsizeof(obj)
+        fields = getattr(obj, '__dict__', None)
+        if fields is not None:
+            size += sys.getsizeof(fields) + sum(sys.getsizeof(value) for value in fields.values() if _fixed(value))
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                value = getattr(obj, slot, None)
+                if value is not None and _fixed(value):
+                    size += sys.getsizeof(value)
+        _sizes[type(obj)] = size
+    return size
+
+
+class ProofArchive:
+    # Payment proofs of settled payments, at most `max_entries` of them (oldest dropped first).
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.proofs = collections.OrderedDict()
+
+    def add(self, payment_hash, proof):
+        self.proofs[payment_hash] = proof
+        if self.max_entries is not None and len(self.proofs) > self.max_entries:
+            self.proofs.popitem(last=False)
+
+    def get(self, payment_hash):
+        return self.proofs.get(payment_hash)
+
+    def __len__(self):
+        return len(self.proofs)
+
+    def nbytes(self):
+        return sum(len(key) + len(proof) for key, proof in self.proofs.items())
+
+
+class Retention:
+    # ttl           seconds of inactivity after which an entry expires, None to keep entries
+    # max_entries   cap on tracked entries, None for no cap
+    # max_bytes     cap on estimated bytes of tracked entries, None for no cap
+    # archive_size  cap on archived proofs, None for no cap
+    # sweep_interval  seconds between two sweeps of expired entries, defaults to ttl / 4
+    def __init__(self, ttl=None, max_entries=None, max_bytes=None, archive_size=None, sweep_interval=None,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval if sweep_interval is not None else (ttl / 4 if ttl else None)
+        self.clock = clock
+        self.archive = ProofArchive(archive_size)
+        # (kind, key) -> [last use, estimated bytes], least recently used first
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.next_sweep = clock() + self.sweep_interval if self.sweep_interval else math.inf
+        self.capped = max_entries is not None or max_bytes is not None
+        # (kind, reason) -> evicted entries
+        self.evicted = collections.Counter()
+        self.evicted_bytes = 0
+
+    # record use of an entry, `size` bytes are added to its estimated size
+    def track(self, node, kind, key, size=0):
+        now = self.clock()
+        entries = self.entries
+        entry = entries.get((kind, key))
+        if entry is None:
+            entries[kind, key] = [now, size]
+        else:
+            entry[0] = now
+            entry[1] += size
+            entries.move_to_end((kind, key))
+        self.nbytes += size
+        if now >= self.next_sweep:
+            self.sweep(node, now)
+        if self.capped:
+            self.enforce_caps(node)
+
+    # a claimed payment was settled by the node: stop tracking its invoice and parts and
+    # archive its payment proof
+    def settled(self, node, group_key, invoice):
+        keys = [(RECEIVED, group_key)]
+        if invoice is not None:
+            keys.append((INVOICE, invoice.payment_hash))
+            proof = node.scheme.proof(invoice)
+            if proof is not None:
+                self.archive.add(invoice.payment_hash, proof)
+        for kind, key in keys:
+            entry = self.entries.pop((kind, key), None)
+            if entry is not None:
+                self.nbytes -= entry[1]
+                self.evicted_bytes += entry[1]
+                self.evicted[kind, SETTLED] += 1
+
+    # evict entries unused for ttl seconds, return the number of evicted entries
+    def sweep(self, node, now=None):
+        if self.ttl is None:
+            return 0
+        now = self.clock() if now is None else now
+        if self.sweep_interval:
+            self.next_sweep = now + self.sweep_interval
+        count = 0
+        entries = self.entries
+        while entries:
+            (kind, key), (last_use, _) = next(iter(entries.items()))
+            if now - last_use < self.ttl:
+                break
+            self.evict(node, kind, key, EXPIRED)
+            count += 1
+        return count
+
+    # evict least recently used entries until the node is within the caps
+    def enforce_caps(self, node):
+        entries = self.entries
+        while entries and ((self.max_entries is not None and len(entries) > self.max_entries)
+                           or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            kind, key = next(iter(entries))
+            self.evict(node, kind, key, EVICTED)
+
+    def evict(self, node, kind, key, reason):
+        entry = self.entries.pop((kind, key), None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+            self.evicted_bytes += entry[1]
+        self.evicted[kind, reason] += 1
+        if kind == INVOICE:
+            node.invoices.pop(key, None)
+        elif kind == PAYMENT:
+            node.drop_payment(key)
+        elif kind == TOMBSTONE:
+            node.settled.discard(key)
+        else:
+            node.drop_received(key)
+
+    def metrics(self):
+        metrics = {
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'evicted_bytes': self.evicted_bytes,
+            'archived': len(self.archive),
+            'archive_bytes': self.archive.nbytes(),
+        }
+        for (kind, reason), count in sorted(self.evicted.items()):
+            metrics[f'evicted.{kind}.{reason}'] = count
+        return metrics
+
+
+profiling.register(Retention, 'evict', 'retention.evict', profiling.COUNTER)
+profiling.register(Retention, 'sweep', 'retention.sweep')
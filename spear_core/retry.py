@@ -0,0 +1,92 @@
+# Payer side delivery of a payment over a lossy network.
+#
+# The payer sends `parts_count` parts of a payment. Parts which fail on the way are replaced
+# by parts of the same payment which were never sent, the redundant parts, and only when
+# those run out new top-up parts are added to the payment. Neither a new payment nor new
+# secrets for the parts already delivered are needed.
+#
+#     retry = PaymentRetry(payer, payer.create_payment(payment_hash, 100, 5, 2))
+#     for index, part in retry.dispatch():
+#         forward(index, part)            # calls retry.delivered(index) or retry.failed(index)
+#     ...                                 # dispatch again until retry.complete()
+#     secrets = retry.reveal(parts)       # parts chosen by the payee
+#
+# A failed part is dropped for good and its locked amount is released.
+
+PENDING = 'pending'
+FAILED = 'failed'
+DELIVERED = 'delivered'
+REVEALED = 'revealed'
+
+
+class PaymentRetry:
+    def __init__(self, node, payment):
+        self.node = node
+        self.payment = payment
+        # part index -> state, parts never sent have no state
+        self.states = {}
+        # parts before this index have been sent
+        self.next_index = 0
+        self.topped_up = 0
+
+    def count(self, state):
+        return sum(1 for s in self.states.values() if s == state)
+
+    def indexes(self, state):
+        return [index for index, s in self.states.items() if s == state]
+
+    # parts which cover the payment amount once pending and delivered parts are counted
+    def missing(self):
+        covered = sum(1 for s in self.states.values() if s != FAILED)
+        return max(self.payment.parts_count - covered, 0)
+
+    # Parts to send to cover the payment amount, as (index, part). Unsent parts are used
+    # first, top-up parts are generated (and locked) only for what they can't cover.
+    def dispatch(self):
+        missing = self.missing()
+        if not missing:
+            return []
+        parts = self.payment.parts
+        unsent = len(parts) - self.next_index
+        if missing > unsent:
+            self.node.top_up_payment(self.payment, missing - unsent)
+            self.topped_up += missing - unsent
+        start = self.next_index
+        self.next_index += missing
+        for index in range(start, self.next_index):
+            self.states[index] = PENDING
+        return [(index, parts[index]) for index in range(start, self.next_index)]
+
+    def _transition(self, index, state):
+        if self.states.get(index) != PENDING:
+            raise Exception(f"Part {index} is not pending")
+        self.states[index] = state
+
+    def delivered(self, index):
+        self._transition(index, DELIVERED)
+
+    def failed(self, index):
+        self._transition(index, FAILED)
+        self.node.release_parts(self.payment, 1)
+
+    # whether the delivered parts pay the payment
+    def complete(self):
+        return self.count(DELIVERED) >= self.payment.parts_count
+
+    # reveal the secrets of delivered parts, `parts` defaults to all delivered parts in order
+    def reveal(self, parts=None):
+        payment_parts = self.payment.parts
+        delivered = self.indexes(DELIVERED)
+        if parts is None:
+            parts = [payment_parts[index] for index in delivered]
+            indexes = delivered
+        else:
+            part_key = self.node.scheme.part_key
+            by_key = {part_key(payment_parts[index]): index for index in delivered}
+            indexes = [by_key.get(part_key(part)) for part in parts]
+            if None in indexes:
+                raise Exception(f"Reject to reveal {self.node.scheme.part_name.lower()}s which were not delivered")
+        secrets = self.node.reveal_parts(parts)
+        for index in indexes:
+            self.states[index] = REVEALED
+        return secrets
@@ -0,0 +1,205 @@
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+# Payee sharded over worker processes.
+#
+# Invoices are partitioned by payment hash across N worker processes, each one owns a plain
+# Node with the invoices, received parts and claims of its partition. The front-end only
+# routes: parts and claims go to the shard owning their payment hash over a pipe, so claims
+# of different payments are verified in parallel on different cores.
+#
+#     payee = ShardedPayee(Node, shards=4)
+#     invoice = payee.new_invoice(100)
+#     ...
+#     payee.receive(ptlcs)
+#     results = payee.claim_many([(ptlcs, secrets), ...])
+#     payee.close()
+
+
+# Exceptions cross the pipe as messages: an exception object may not pickle, or not unpickle
+# in the front-end (custom __init__ arguments), and a worker failing to send its reply would
+# leave the front-end waiting for it.
+def _error_message(e):
+    message = str(e)
+    if type(e) is Exception:
+        return message
+    return f"{type(e).__name__}: {message}" if message else type(e).__name__
+
+
+def _portable(result):
+    # claim_many returns the exception each payment failed with
+    if isinstance(result, list):
+        return [Exception(_error_message(item)) if isinstance(item, Exception) else item for item in result]
+    return result
+
+
+# worker process loop, runs node methods sent by the front-end until the pipe is closed
+def _serve(conn, node_class):
+    node = node_class()
+    node.verbose = False
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        method, args = message
+        try:
+            reply = (True, _portable(getattr(node, method)(*args)))
+        except Exception as e:
+            reply = (False, _error_message(e))
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            break
+        except Exception as e:
+            conn.send((False, f"Reply of {method} can't be sent: {_error_message(e)}"))
+    conn.close()
+
+
+class ShardedPayee:
+    def __init__(self, node_class, shards=None, context='spawn'):
+        scheme = node_class.scheme
+        if not scheme.groups_by_payment_hash:
+            raise Exception(f"{scheme.part_name}s of {node_class.__module__} are not grouped by payment hash and can't be sharded")
+        self.node_class = node_class
+        self.scheme = scheme
+        ctx = multiprocessing.get_context(context)
+        self.processes = []
+        self.conns = []
+        for _ in range(shards or multiprocessing.cpu_count()):
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=_serve, args=(child, node_class), daemon=True)
+            process.start()
+            child.close()
+            self.processes.append(process)
+            self.conns.append(parent)
+
+    @property
+    def shards(self):
+        return len(self.conns)
+
+    def shard_of(self, payment_hash):
+        return int.from_bytes(payment_hash[:8], 'little') % len(self.conns)
+
+    # Send calls to shards and wait for all replies. `calls` is a list of (shard, method, args),
+    # the reply of each call comes back in the same order, the exception it raised if it
+    # failed. A shard has at most one call in flight: a worker blocked on sending a reply
+    # while the front-end is blocked on sending it the next call would deadlock once the
+    # pipe buffers are full. Shards still work in parallel, the next call of a shard is sent
+    # as soon as its reply is read. When a shard's pipe breaks, its remaining calls fail
+    # and the other shards carry on.
+    def _call_many(self, calls):
+        queues = {}
+        for position, (shard, method, args) in enumerate(calls):
+            queues.setdefault(shard, collections.deque()).append((position, method, args))
+        results = [None] * len(calls)
+        # connection -> (shard, position of the call in flight)
+        in_flight = {}
+
+        def fail_shard(shard, position, e):
+            error = Exception(f"Shard {shard} is gone: {_error_message(e)}")
+            results[position] = error
+            for queued, _, _ in queues.pop(shard):
+                results[queued] = error
+
+        def send_next(shard):
+            position, method, args = queues[shard].popleft()
+            conn = self.conns[shard]
+            try:
+                conn.send((method, args))
+            except (EOFError, OSError) as e:
+                fail_shard(shard, position, e)
+                return
+            in_flight[conn] = shard, position
+
+        for shard in list(queues):
+            send_next(shard)
+        while in_flight:
+            for conn in multiprocessing.connection.wait(list(in_flight)):
+                shard, position = in_flight.pop(conn)
+                try:
+                    ok, result = conn.recv()
+                except (EOFError, OSError) as e:
+                    fail_shard(shard, position, e)
+                    continue
+                results[position] = result if ok else Exception(result)
+                if queues[shard]:
+                    send_next(shard)
+        return results
+
+    # call one method on a shard, raise its exception if it failed
+    def _call(self, shard, method, *args):
+        return self._check(self._call_many([(shard, method, args)]))[0]
+
+    # raise the first exception of call results
+    @staticmethod
+    def _check(results):
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    # create a new invoice and hand it to the shard owning its payment hash
+    def new_invoice(self, amount):
+        invoice = self.scheme.new_invoice(amount)
+        self.add_invoice(invoice)
+        return invoice
+
+    def add_invoice(self, invoice):
+        self._call(self.shard_of(invoice.payment_hash), 'add_invoice', invoice)
+
+    # route received parts to their shards
+    def receive(self, parts):
+        by_shard = {}
+        for part in parts:
+            by_shard.setdefault(self.shard_of(self.scheme.group_key(part)), []).append(part)
+        self._check(self._call_many([(shard, 'receive_parts', (shard_parts,)) for shard, shard_parts in by_shard.items()]))
+
+    def get_received(self, payment_hash):
+        return self._call(self.shard_of(payment_hash), 'get_received_parts', payment_hash)
+
+    def claim(self, parts, secrets):
+        return self._call(self.shard_of(self.scheme.group_key(parts[0])), 'claim_parts', parts, secrets)
+
+    # Claim several payments given as (parts, secrets), the claims of a shard are sent as one
+    # batch and shards verify their batches in parallel. Like Node.claim_many, return the
+    # claim result of each payment or the exception a payment failed with.
+    def claim_many(self, claims):
+        by_shard = {}
+        for position, (parts, secrets) in enumerate(claims):
+            shard = self.shard_of(self.scheme.group_key(parts[0]))
+            by_shard.setdefault(shard, []).append(position)
+        shards = list(by_shard)
+        replies = self._call_many([(shard, 'claim_many', ([claims[position] for position in by_shard[shard]],))
+                                   for shard in shards])
+        results = [None] * len(claims)
+        for shard, reply in zip(shards, replies):
+            positions = by_shard[shard]
+            # the whole batch failed, every claim of the shard failed with it
+            if isinstance(reply, Exception):
+                reply = [reply] * len(positions)
+            for position, result in zip(positions, reply):
+                results[position] = result
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join()
+        self.conns = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
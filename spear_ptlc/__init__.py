@@ -1,4 +1,14 @@
 # spear_ptlc package
-from spear_ptlc.test import run_test
+import importlib
 
-__all__ = ['node', 'test', 'run_test'] 
+__all__ = ['node', 'test', 'run_test']
+
+
+# submodules are imported on first use (PEP 562), importing the package is cheap
+def __getattr__(name):
+    if name == 'run_test':
+        from spear_ptlc.test import run_test
+        return run_test
+    if name in ('node', 'test'):
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
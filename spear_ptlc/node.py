@@ -1,11 +1,25 @@
+import functools
 import hashlib
-import random
+import itertools
+import operator
+import struct
+import sys
+from spear_core import engine, profiling, rand
+from spear_core.retention import estimate_size
 from spear_ptlc import secp256k1
 
+# size of the random weights used by verify_proofs
+PROOF_WEIGHT_BITS = 128
+
 def random_bytes():
-    return random.randbytes(32)
+    return rand.random_bytes(32)
+
+class PTLC(engine.WireRecord):
+    __slots__ = ('id', 'amount', 'point', 'payment_hash')
+
+    # wire format: id (u32) || amount (f64) || payment hash (32 bytes) || SEC1 compressed point
+    wire_format = struct.Struct('<Id32s33s')
 
-class PTLC:
     def __init__(self, id, amount, payment_hash, point):
         self.id = id
         self.amount = amount
@@ -13,184 +27,215 @@ class PTLC:
         self.payment_hash = payment_hash
 
     def verify(self, secret):
-        return secp256k1.G * secret == self.point
+        return secp256k1.mul_g(secret) == self.point
+
+    def _wire_fields(self):
+        return self.id, self.amount, self.payment_hash, self.point.encode()
+
+    # points of the parts are decompressed in one batch
+    @classmethod
+    def _from_fields(cls, fields):
+        fields = list(fields)
+        points = secp256k1.decode_points([f[3] for f in fields])
+        return [cls(id, amount, payment_hash, point) for (id, amount, payment_hash, _), point in zip(fields, points)]
 
 class SecretKey:
+    __slots__ = ('k',)
+
     def __init__(self, k=None):
-        self.k = k or secp256k1.Fr(random.randint(0, secp256k1.N))
+        self.k = k or secp256k1.Fr(rand.random_scalar(secp256k1.N))
     
     def pubkey(self):
-        return PublicKey(secp256k1.G * self.k)
+        return PublicKey(secp256k1.mul_g(self.k))
 
 class PublicKey:
     def __init__(self, pubkey):
         self.pubkey = pubkey
 
+    # the hash is computed on first use only
+    @functools.cached_property
+    def payment_hash(self):
+        return hashlib.sha256(self.pubkey.x.x.to_bytes(32, 'little') + self.pubkey.y.x.to_bytes(32, 'little')).digest()
+
     def compute_hash(self):
-        return hashlib.sha256(self.pubkey.x.x.to_bytes(32, 'little') + self.pubkey.y.x.to_bytes(32, 'little')).hexdigest()
+        return self.payment_hash
+
+    def encode(self):
+        return self.pubkey.encode()
+
+    @classmethod
+    def decode(cls, data):
+        return cls(secp256k1.decode_point(data))
     
-class Payment:
+class Payment(engine.Payment):
     def __init__(self, point, amount, parts_count, redundant_parts_count):
         self.pubkey = point
-        self.payment_hash = point.compute_hash()
-        self.amount = amount
-        self.amount_per_part = amount / parts_count
-        self.locked_amount = amount + self.amount_per_part * redundant_parts_count
-        self.parts_count = parts_count
-        self.redundant_parts_count = redundant_parts_count
-        self.ptlcs = []
+        # payment proof once extracted and checked against the invoice pubkey
+        self.proof = None
         self.hop_secrets = []
-
-        # generate HHTLC hashes for each part
-        for i in range(parts_count + redundant_parts_count):
+        # locking point of every part
+        self.points = []
+        super().__init__(point.compute_hash(), amount, parts_count, redundant_parts_count)
+        self.ptlcs = self.parts
+
+    # generate PTLC points for each part
+    def add_parts(self, count):
+        for i in range(count):
             # generate random secret for each hop (for simplicity we has 0 hops)
-            hop_secret = secp256k1.Fr(random.randint(0, secp256k1.N))
-            point = self.pubkey.pubkey + secp256k1.G * hop_secret
-            self.ptlcs.append(PTLC(i, self.amount_per_part, self.payment_hash, point))
+            hop_secret = secp256k1.Fr(rand.random_scalar(secp256k1.N))
+            self.points.append(self.pubkey.pubkey + secp256k1.mul_g(hop_secret))
             self.hop_secrets.append(hop_secret)
+        self.parts.extend(itertools.repeat(self.amount_per_part, count))
+
+    # part ids are their index in the payment
+    def part(self, index):
+        return PTLC(index, self.parts.amounts[index], self.payment_hash, self.points[index])
+
+    # a point and a hop secret per part
+    def nbytes(self):
+        size = super().nbytes() + sys.getsizeof(self.points) + sys.getsizeof(self.hop_secrets)
+        if self.points:
+            size += len(self.points) * (estimate_size(self.points[0]) + estimate_size(self.hop_secrets[0]))
+        return size
+
+# check a payment proof against the invoice pubkey (a PublicKey or a point)
+def verify_proof(pubkey, proof):
+    point = pubkey.pubkey if isinstance(pubkey, PublicKey) else pubkey
+    return secp256k1.mul_g(proof) == point
+
+# Check many (pubkey, proof) pairs at once. With random weights a_i (a_0 = 1) all checks are
+# combined into (Σ a_i ∗ proof_i) ∗ G =? Σ a_i ∗ P_i, evaluated with one fixed-base and one
+# multi-scalar multiplication. An invalid proof passes with probability 2^-PROOF_WEIGHT_BITS,
+# and a failed batch doesn't tell which proof is invalid.
+def verify_proofs(pairs):
+    if not pairs:
+        return True
+    proof_sum = 0
+    weights = {}
+    for index, (pubkey, proof) in enumerate(pairs):
+        point = pubkey.pubkey if isinstance(pubkey, PublicKey) else pubkey
+        a = 1 if index == 0 else rand.randbits(PROOF_WEIGHT_BITS) | 1
+        proof_sum += a * proof.x
+        # weights of the same pubkey are merged
+        key = (point.x.x, point.y.x)
+        if key in weights:
+            weights[key][1] += a
+        else:
+            weights[key] = [point, a]
+    points = [point for point, _ in weights.values()]
+    scalars = [secp256k1.Fr(weight) for _, weight in weights.values()]
+    return secp256k1.mul_g(secp256k1.Fr(proof_sum)) == secp256k1.msm(points, scalars)
 
 class Invoice:
+    __slots__ = ('secret_key', 'pubkey', 'amount', 'payment_hash')
+
     def __init__(self, amount):
         self.secret_key = SecretKey()
         self.pubkey = self.secret_key.pubkey()
         self.amount = amount
         self.payment_hash = self.pubkey.compute_hash()
 
-class Node:
-    def __init__(self):
-        self.balance = 0
-        self.locked_balance = 0
-        self.payments = []
-        self.invoices = []
-        self.received_ptlcs = []
-
-    # lock balance
-    def lock_balance(self, amount):
-        if self.balance < amount:
-            raise Exception("Insufficient balance")
-        self.balance -= amount
-        self.locked_balance += amount
-
-    # unlock balance
-    def unlock_balance(self, amount):
-        if self.locked_balance < amount:
-            raise Exception("Insufficient locked balance")
-        self.locked_balance -= amount
-        self.balance += amount
+# PTLC: parts are locked by the invoice pubkey tweaked with a per part hop secret
+class PTLCScheme(engine.LockScheme):
+    part_name = 'PTLC'
+    secret_name = 'secret'
+
+    def new_invoice(self, amount):
+        return Invoice(amount)
+
+    def new_payment(self, pubkey, amount, parts_count, redundant_parts_count):
+        return Payment(pubkey, amount, parts_count, redundant_parts_count)
+
+    part_key = operator.attrgetter('payment_hash', 'id')
+
+    def reveal(self, payment, ptlc):
+        if ptlc.id >= len(payment.hop_secrets):
+            raise Exception("Payer hop secret not found")
+        # hop secret is sum of all hops secret value
+        # for simplicity we has 0 hops so hop secret is just one secret value
+        return payment.hop_secrets[ptlc.id]
+
+    def reveal_all(self, payment, ptlcs):
+        hop_secrets = payment.hop_secrets
+        try:
+            return [hop_secrets[ptlc.id] for ptlc in ptlcs]
+        except IndexError:
+            raise Exception("Payer hop secret not found")
+
+    def verify_claim(self, node, invoice, ptlcs, secrets):
+        if invoice is None:
+            raise Exception("Invoice not found")
+        # check secrets
+        claim_secrets = []
+        for index, ptlc in enumerate(ptlcs):
+            node.log(f"Verify part {ptlc.id} payment_hash: {ptlc.payment_hash.hex()}")
+            secret = invoice.secret_key.k + secrets[index]
+            if not ptlc.verify(secret):
+                raise Exception("Invalid secret key / hop secret")
+            claim_secrets.append(secret)
+        return claim_secrets
+
+    # the invoice secret key proves the payment
+    def proof(self, invoice):
+        return invoice.secret_key.k.x.to_bytes(32, 'big')
+
+class Node(engine.Node):
+    scheme = PTLCScheme()
 
     # payee create new invoice
-    # return payment hash and amount
+    # return payment hash, pubkey and amount
     def new_invoice(self, amount):
-        invoice = Invoice(amount)
-        self.invoices.append(invoice)
+        invoice = self.create_invoice(amount)
         return invoice.payment_hash, invoice.pubkey, invoice.amount
 
     # payer gen redandent payment parts
     # return locked parts
     def pay(self, pubkey, amount, parts_count, redundant_parts_count):
-        payment = Payment(pubkey, amount, parts_count, redundant_parts_count)
-        self.lock_balance(payment.locked_amount)
-        self.payments.append(payment)
-        return payment.ptlcs
+        return self.create_payment(pubkey, amount, parts_count, redundant_parts_count).ptlcs
 
     # payer reveal preimages of payment ptlcs to payee
     def reveal_ptlcs(self, ptlcs):
-        # all parts should be from the same payment
-        payment_hash = None
-        for ptlc in ptlcs:
-            if payment_hash is None:
-                payment_hash = ptlc.payment_hash
-            elif payment_hash != ptlc.payment_hash:
-                raise Exception("PTLCs are from different payments")
-        
-        # find payment
-        payment = None
-        for p in self.payments:
-            if p.payment_hash == payment_hash:
-                payment = p
-                break
-        if payment is None:
-            raise Exception("Payment not found")
-            
-        # check total amount of parts
-        total_amount = sum([ptlc.amount for ptlc in ptlcs])
-        if total_amount != payment.amount:
-            raise Exception(f"Reject to reveal ptlcs because of invalid amount {total_amount} != {payment.amount}")
-
-        # find secrets for each part
-        secrets = []
-        for ptlc in ptlcs:
-            payment_hash = ptlc.payment_hash
-            hop_secret = payment.hop_secrets[ptlc.id]
-            if hop_secret is None:
-                raise Exception("Payer hop secret not found")
-            # hop secret is sum of all hops secret value
-            # for simplicity we has 0 hops so hop secret is just one secret value
-            secrets.append(hop_secret)
-        
-        # check secrets count
-        if len(secrets) != len(ptlcs):
-            raise Exception("Invalid secrets count")
-        return secrets
+        return self.reveal_parts(ptlcs)
 
     # payee receive locked parts
     def receive_ptlcs(self, ptlcs):
-        # deduplicate parts
-        for ptlc in ptlcs:
-            if ptlc not in self.received_ptlcs:
-                self.received_ptlcs.append(ptlc)
-    
-    def find_invoice(self, payment_hash):
-        for invoice in self.invoices:
-            if invoice.payment_hash == payment_hash:
-                return invoice
-        return None
-    
-    def find_payment(self, payment_hash):
-        for payment in self.payments:
-            if payment.payment_hash == payment_hash:
-                return payment
-        return None
+        self.receive_parts(ptlcs)
+
+    @property
+    def received_ptlcs(self):
+        return self.received_parts()
 
     # return ptlcs or None if not enough ptlcs
     def get_received_ptlcs(self, payment_hash):
-        invoice = self.find_invoice(payment_hash)
-        if invoice is None:
-            return None
-        ptlcs = []
-        total_amount = 0
-        for ptlc in self.received_ptlcs:
-            if ptlc.payment_hash == payment_hash:
-                ptlcs.append(ptlc)
-                total_amount += ptlc.amount
-            if total_amount == invoice.amount:
-                break
-            # assume parts amount is fixed
-            if total_amount > invoice.amount:
-                raise Exception("Invalid payment amount")
-        # check if enough parts
-        if total_amount < invoice.amount:
-            print(f"Not enough ptlcs, total amount: {total_amount}, invoice amount: {invoice.amount}")
-            return None
-        return ptlcs
+        return self.get_received_parts(payment_hash)
 
+    # return claim secrets, the payer extracts the payment proof from them
     def claim(self, ptlcs, secrets):
-        # check secrets count
-        if len(secrets) != len(ptlcs):
-            raise Exception("Invalid secrets count")
-        # find invoice
-        invoice = self.find_invoice(ptlcs[0].payment_hash)
-        if invoice is None:
-            raise Exception("Invoice not found")
-        # check secrets
-        claim_secrets = []
-        for index, ptlc in enumerate(ptlcs):
-            print(f"Verify part {ptlc.id} payment_hash: {ptlc.payment_hash}")
-            secret = invoice.secret_key.k + secrets[index]
-            if not ptlc.verify(secret):
-                raise Exception("Invalid secret key / hop secret")
-            claim_secrets.append(secret)
-
-        # Claim payment
-        print("Claim payment")
-        return claim_secrets
+        return self.claim_parts(ptlcs, secrets)
+
+    # Payer extracts the payment proof (the invoice secret key) from the claim secrets of the
+    # revealed ptlcs, claim secrets are in the order the ptlcs were revealed.
+    # Every claim secret minus its hop secret must give the same proof: the proof is taken
+    # from the first claim secret and checked once against the invoice pubkey, the other
+    # claim secrets are only compared as scalars.
+    def extract_payment_proof(self, payment_hash, claim_secrets):
+        payment = self.find_payment(payment_hash)
+        if payment is None:
+            raise Exception("Payment not found")
+        revealed = payment.revealed
+        if not revealed or len(claim_secrets) != len(revealed):
+            raise Exception("Invalid claim secrets count")
+        hop_secrets = payment.hop_secrets
+        proof = claim_secrets[0] - hop_secrets[revealed[0].id]
+        if payment.proof is None or proof != payment.proof:
+            if not verify_proof(payment.pubkey, proof):
+                raise Exception("Payment proof is not verified")
+            payment.proof = proof
+        k = proof.x
+        if [secret.x for secret in claim_secrets] != [(k + hop_secrets[ptlc.id].x) % secp256k1.N for ptlc in revealed]:
+            raise Exception("Payment proof is not consistent")
+        return proof
+
+
+for method in ('new_invoice', 'pay', 'receive_ptlcs', 'get_received_ptlcs', 'reveal_ptlcs', 'claim', 'extract_payment_proof'):
+    profiling.register(Node, method, f'spear_ptlc.Node.{method}')
@@ -1,6 +1,6 @@
 import hashlib
-import random
-import secp256k1
+from spear_core import rand
+from spear_ptlc import secp256k1
 
 # https://github.com/bitcoin/bips/blob/master/bip-0340.mediawiki
 #
@@ -10,35 +10,122 @@ import secp256k1
 #   1. ....
 #   2. Signatures are pairs (R, s) that satisfy s⋅G = R + hash(R || m)⋅P. This supports batch verification, as there
 #      are no elliptic curve operations inside the hashes. Batch verification enables significant speedups.
+#
+# Messages are scalars, use `hash_message` to turn bytes into a message.
+
+# Size of the random weights used by batch verification.
+BATCH_WEIGHT_BITS = 128
+
+
+def random_scalar():
+    return secp256k1.Fr(rand.random_scalar(secp256k1.N))
+
+
+def hash_message(data):
+    return secp256k1.Fr(int.from_bytes(hashlib.sha256(data).digest(), 'little'))
 
-prikey = secp256k1.Fr(0x5f6717883bef25f45a129c11fcac1567d74bda5a9ad4cbffc8203c0da2a1473c)
-pubkey = secp256k1.G * prikey
 
-# Hash of messages.
-with open('./spear_ptlc/secp256k1.py', 'rb') as f:
-    m = int.from_bytes(hashlib.sha256(f.read()).digest(), 'little')
-    m = secp256k1.Fr(m)
-print(f'hash={m}')
+# e = hash(R || m)
+def challenge(R, m):
+    hasher = hashlib.sha256()
+    hasher.update(R.x.x.to_bytes(32, 'little'))
+    hasher.update(R.y.x.to_bytes(32, 'little'))
+    hasher.update(m.x.to_bytes(32, 'little'))
+    return secp256k1.Fr(int.from_bytes(hasher.digest(), 'little'))
+
 
 # R = k ∗ G
 # e = hash(R || m)
 # s = k + e ∗ prikey
-k = secp256k1.Fr(random.randint(0, secp256k1.N))
-R = secp256k1.G * k
-hasher = hashlib.sha256()
-hasher.update(R.x.x.to_bytes(32, 'little'))
-hasher.update(R.y.x.to_bytes(32, 'little'))
-hasher.update(m.x.to_bytes(32, 'little'))
-e = secp256k1.Fr(int.from_bytes(hasher.digest(), 'little'))
-s = k + e * prikey
-
-t = secp256k1.Fr(random.randint(0, secp256k1.N))
-# T = secp256k1.G * t
-s1 = s + t
+def sign(prikey, m, k=None):
+    k = k or random_scalar()
+    R = secp256k1.mul_g(k)
+    e = challenge(R, m)
+    return R, k + e * prikey
 
-print(f'sign=(R={R}, s\'={s1} s={s})')
 
 # s ∗ G =? R + hash(R || m) ∗ P
-s = s1 - t
-verify = secp256k1.G * s == R + pubkey * e
-print(f'verify={verify}')
+def verify(R, s, P, m):
+    e = challenge(R, m)
+    return secp256k1.mul_g(s) == R + P * e
+
+
+# Adaptor signature for the adaptor point T = t ∗ G.
+# The pre-signature s' = k + hash(R + T || m) ∗ prikey is not a valid signature, it becomes
+# one once the secret t is added: (R + T, s' + t). Whoever sees both s' and the completed
+# signature learns t = s - s'.
+def adaptor_sign(prikey, m, T, k=None):
+    k = k or random_scalar()
+    R = secp256k1.mul_g(k)
+    e = challenge(R + T, m)
+    return R, k + e * prikey
+
+
+# s' ∗ G =? R + hash(R + T || m) ∗ P
+def adaptor_verify(R, s, P, m, T):
+    e = challenge(R + T, m)
+    return secp256k1.mul_g(s) == R + P * e
+
+
+# complete a pre-signature with the adaptor secret t, return the final signature
+def adaptor_complete(R, s, t):
+    return R + secp256k1.mul_g(t), s + t
+
+
+# recover the adaptor secret from a pre-signature and the completed signature
+def adaptor_extract(s, presig_s):
+    return s - presig_s
+
+
+# Verify many (R, s, P, m) signatures at once.
+# With random weights a_i (a_0 = 1) all equations are combined into one:
+#   (Σ a_i ∗ s_i) ∗ G =? Σ a_i ∗ R_i + Σ (a_i ∗ e_i) ∗ P_i
+# the right side is evaluated with a single multi-scalar multiplication, weights of signatures
+# under the same public key are merged first. A forged signature passes only with probability
+# 2^-BATCH_WEIGHT_BITS, but a failed batch doesn't tell which signature is invalid.
+def batch_verify(signatures):
+    if not signatures:
+        return True
+    s_sum = 0
+    points = []
+    scalars = []
+    pubkeys = {}
+    for index, (R, s, P, m) in enumerate(signatures):
+        a = 1 if index == 0 else rand.randbits(BATCH_WEIGHT_BITS) | 1
+        e = challenge(R, m)
+        s_sum += a * s.x
+        points.append(R)
+        scalars.append(secp256k1.Fr(a))
+        key = (P.x.x, P.y.x)
+        if key in pubkeys:
+            pubkeys[key][1] += a * e.x
+        else:
+            pubkeys[key] = [P, a * e.x]
+    for P, weight in pubkeys.values():
+        points.append(P)
+        scalars.append(secp256k1.Fr(weight))
+    return secp256k1.mul_g(secp256k1.Fr(s_sum)) == secp256k1.msm(points, scalars)
+
+
+if __name__ == '__main__':
+    prikey = secp256k1.Fr(0x5f6717883bef25f45a129c11fcac1567d74bda5a9ad4cbffc8203c0da2a1473c)
+    pubkey = secp256k1.mul_g(prikey)
+    m = hash_message(b'spear')
+    print(f'hash={m}')
+
+    R, s = sign(prikey, m)
+    print(f'sign=(R={R}, s={s})')
+    print(f'verify={verify(R, s, pubkey, m)}')
+
+    t = random_scalar()
+    T = secp256k1.mul_g(t)
+    R, presig = adaptor_sign(prikey, m, T)
+    print(f'adaptor verify={adaptor_verify(R, presig, pubkey, m, T)}')
+    R, s = adaptor_complete(R, presig, t)
+    print(f'completed verify={verify(R, s, pubkey, m)}')
+    print(f'extracted adaptor secret={adaptor_extract(s, presig) == t}')
+
+    signatures = [sign(prikey, hash_message(bytes([i]))) + (pubkey, hash_message(bytes([i]))) for i in range(4)]
+    print(f'batch verify={batch_verify(signatures)}')
+    R, s, P, m = signatures[1]
+    print(f'batch verify with a bad signature={batch_verify(signatures[:1] + [(R, s + secp256k1.Fr(1), P, m)])}')
@@ -1,3 +1,15 @@
+import functools
+import hashlib
+import os
+import sys
+
+try:
+    from spear_core import profiling
+except ImportError:
+    # run standalone as a self-test, python spear_ptlc/secp256k1.py, without the package
+    profiling = None
+
+
 class Fp:
     # Galois field. In mathematics, a finite field or Galois field is a field that contains a finite number of elements.
     # As with any field, a finite field is a set on which the operations of multiplication, addition, subtraction and
@@ -32,11 +44,14 @@ class Fp:
         return self.__class__((self.x * data.x) % self.p)
 
     def __truediv__(self, data):
-        return self * data ** -1
+        return self * data.inv()
 
     def __pow__(self, data):
         return self.__class__(pow(self.x, data, self.p))
 
+    def inv(self):
+        return self.__class__(pow(self.x, -1, self.p))
+
     def __pos__(self):
         return self
 
@@ -107,6 +122,41 @@ class Pt:
     def __eq__(self, data):
         return self.x == data.x and self.y == data.y
 
+    def __hash__(self):
+        return hash((self.x.x, self.y.x))
+
+    # Build a point which is already known to be on the curve, skipping the check of __init__.
+    @classmethod
+    def trusted(cls, x, y):
+        pt = cls.__new__(cls)
+        pt.x = x
+        pt.y = y
+        return pt
+
+    # SEC1 encoding, 33 bytes compressed (0x02/0x03 || x) or 65 bytes uncompressed (0x04 || x || y),
+    # the identity is the single byte 0x00.
+    # Points are never mutated, so the compressed encoding is computed once and kept on the point.
+    def encode(self, compressed=True):
+        if not compressed:
+            if self.is_identity():
+                return b'\x00'
+            return b'\x04' + self.x.x.to_bytes(32, 'big') + self.y.x.to_bytes(32, 'big')
+        encoded = self.__dict__.get('_encoded')
+        if encoded is None:
+            if self.is_identity():
+                encoded = b'\x00'
+            else:
+                encoded = bytes([2 + (self.y.x & 1)]) + self.x.x.to_bytes(32, 'big')
+            self._encoded = encoded
+        return encoded
+
+    @classmethod
+    def decode(cls, data):
+        return decode_point(data)
+
+    def is_identity(self):
+        return self.x.x == 0 and self.y.x == 0
+
     def __add__(self, data):
         # https://www.cs.miami.edu/home/burt/learning/Csc609.142/ecdsa-cert.pdf
         # Don Johnson, Alfred Menezes and Scott Vanstone, The Elliptic Curve Digital Signature Algorithm (ECDSA)
@@ -147,7 +197,7 @@ class Pt:
         return result
 
     def __truediv__(self, k):
-        return self.__mul__(k ** -1)
+        return self.__mul__(k.inv())
 
     def __pos__(self):
         return self
@@ -167,6 +217,238 @@ G = Pt(
     Fq(0x4fe342e2fe1a7f9b8ee7eb4a7c0f9e162bce33576b315ececbb6406837bf51f5),
 )
 
+
+
+# Decoding a compressed point costs a square root, decoded points are memoized by encoding.
+@functools.lru_cache(maxsize=4096)
+def _decode(data):
+    if data == b'\x00':
+        return I
+    prefix = data[0]
+    if len(data) == 65 and prefix == 4:
+        x = int.from_bytes(data[1:33], 'big')
+        y = int.from_bytes(data[33:], 'big')
+        if x >= P or y >= P:
+            raise Exception("Invalid point encoding")
+        x, y = Fq(x), Fq(y)
+        # wire input, checked here rather than by the assert of Pt
+        if y * y != x * x * x + A * x + B:
+            raise Exception("Point is not on curve")
+        return Pt.trusted(x, y)
+    if len(data) != 33 or prefix not in (2, 3):
+        raise Exception("Invalid point encoding")
+    x = int.from_bytes(data[1:], 'big')
+    if x >= P:
+        raise Exception("Invalid point encoding")
+    x = Fq(x)
+    y2 = x * x * x + A * x + B
+    y = y2.sqrt()
+    if y * y != y2:
+        raise Exception("Point is not on curve")
+    if y.x & 1 != prefix & 1:
+        y = -y
+    pt = Pt.trusted(x, y)
+    pt._encoded = data
+    return pt
+
+
+def decode_point(data):
+    return _decode(bytes(data))
+
+
+# Decode many SEC1 points, e.g. all parts of a payment.
+# Repeated encodings are decoded once and every distinct point costs a single square root.
+def decode_points(datas):
+    decoded = {}
+    points = []
+    for data in datas:
+        data = bytes(data)
+        pt = decoded.get(data)
+        if pt is None:
+            pt = decoded[data] = _decode(data)
+        points.append(pt)
+    return points
+
+
+# Cost in point additions of a Pippenger window of `c` bits for `n` scalars of `bits` bits:
+# every window adds each point into a bucket, then sums the 2^c buckets with two additions each.
+def _msm_cost(n, bits, c):
+    return -(-bits // c) * (n + (2 << c)) + bits
+
+
+# Multi-scalar multiplication k1 * P1 + k2 * P2 + ... with Pippenger's bucket method.
+# Doublings are shared by all points so it is much faster than summing separate
+# multiplications when there are many points.
+# https://cr.yp.to/papers/pippenger.pdf
+def msm(points, scalars):
+    pairs = [(p, k.x) for p, k in zip(points, scalars) if k.x]
+    if not pairs:
+        return I
+    bits = max(k for _, k in pairs).bit_length()
+    c = min(range(1, 17), key=lambda c: _msm_cost(len(pairs), bits, c))
+    mask = (1 << c) - 1
+
+    result = I
+    for shift in reversed(range(0, bits, c)):
+        for _ in range(c):
+            result = result + result
+        buckets = [None] * (mask + 1)
+        for p, k in pairs:
+            digit = (k >> shift) & mask
+            if digit:
+                bucket = buckets[digit]
+                buckets[digit] = p if bucket is None else bucket + p
+        # sum of digit * bucket[digit] computed as a running sum from the top bucket down
+        running = None
+        window = None
+        for digit in range(mask, 0, -1):
+            bucket = buckets[digit]
+            if bucket is not None:
+                running = bucket if running is None else running + bucket
+            if running is not None:
+                window = running if window is None else window + running
+        if window is not None:
+            result = result + window
+    return result
+
+
+# Fixed-base multiplication k * G with a table of d * 2^(w*i) * G for every w-bit window i
+# and digit d, so that a multiplication is one addition per window and no doubling.
+#
+# The table is built on first use only. Building it costs a few thousand point additions, so
+# it is cached on disk in $SPEAR_CACHE_DIR (default ~/.cache/spear-poc); set SPEAR_CACHE_DIR
+# to an empty string to disable the cache.
+G_WINDOW = 8
+_G_TABLE_VERSION = 1
+_g_table = None
+
+
+def cache_dir():
+    path = os.environ.get('SPEAR_CACHE_DIR')
+    if path is None:
+        path = os.path.join(os.path.expanduser('~'), '.cache', 'spear-poc')
+    return path or None
+
+
+# the checksum covers the curve and the table layout, a table of another curve is rejected
+def _g_table_checksum(payload):
+    hasher = hashlib.sha256()
+    for value in (_G_TABLE_VERSION, G_WINDOW, P, N, A.x, B.x, G.x.x, G.y.x):
+        hasher.update(value.to_bytes(32, 'big'))
+    hasher.update(payload)
+    return hasher.digest()
+
+
+def _build_g_table():
+    table = []
+    base = G
+    for _ in range(-(-N.bit_length() // G_WINDOW)):
+        row = [base]
+        for _ in range((1 << G_WINDOW) - 2):
+            row.append(row[-1] + base)
+        table.append(row)
+        # next window base is 2^w * base
+        base = row[-1] + base
+    return table
+
+
+def _load_g_table(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    checksum, payload = data[:32], data[32:]
+    rows = -(-N.bit_length() // G_WINDOW)
+    per_row = (1 << G_WINDOW) - 1
+    if len(payload) != rows * per_row * 64 or _g_table_checksum(payload) != checksum:
+        return None
+    coordinates = [(int.from_bytes(payload[i:i + 32], 'big'), int.from_bytes(payload[i + 32:i + 64], 'big'))
+                   for i in range(0, len(payload), 64)]
+    if any(x >= P or y >= P for x, y in coordinates):
+        return None
+    points = [Pt.trusted(Fq(x), Fq(y)) for x, y in coordinates]
+    table = [points[i:i + per_row] for i in range(0, len(points), per_row)]
+    return table if _check_g_table(table) else None
+
+
+# The checksum only catches a damaged file. The table decides the result of every signature
+# and claim verification, so every point loaded from the cache is checked to be what the
+# table is built from: the window bases are G, 2^w * G, 2^2w * G, ... and every point is the
+# previous point of its window plus the base. The addition is checked without the inversion
+# it costs: Q = R + B for R != ±B when
+#
+#     (x_Q + x_R + x_B) ∗ (x_B - x_R)^2 = (y_B - y_R)^2
+#     (y_Q + y_R) ∗ (x_B - x_R) = (y_B - y_R) ∗ (x_R - x_Q)
+#
+# which only holds for the point the addition formula gives. Points d * B of a window with
+# 2 <= d < 2^w are never ±B, so this checks the whole table by induction.
+def _check_g_table(table):
+    base = G
+    for row in table:
+        if row[0] != base or row[1] != base + base:
+            return False
+        bx, by = base.x.x, base.y.x
+        for prev, pt in zip(row[1:], row[2:]):
+            x1, y1, x3, y3 = prev.x.x, prev.y.x, pt.x.x, pt.y.x
+            dx = bx - x1
+            dy = by - y1
+            if ((x3 + x1 + bx) * dx * dx - dy * dy) % P or ((y3 + y1) * dx - dy * (x1 - x3)) % P:
+                return False
+        base = row[-1] + base
+    return True
+
+
+def _save_g_table(path, table):
+    payload = b''.join(p.x.x.to_bytes(32, 'big') + p.y.x.to_bytes(32, 'big') for row in table for p in row)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            f.write(_g_table_checksum(payload) + payload)
+        os.replace(tmp, path)
+    except OSError:
+        # the cache is an optimization only
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def g_table():
+    global _g_table
+    if _g_table is None:
+        directory = cache_dir()
+        path = os.path.join(directory, f'p256-g{G_WINDOW}-v{_G_TABLE_VERSION}.bin') if directory else None
+        table = _load_g_table(path) if path else None
+        if table is None:
+            table = _build_g_table()
+            if path:
+                _save_g_table(path, table)
+        _g_table = table
+    return _g_table
+
+
+# k * G for a scalar k, same result as G * k
+def mul_g(k):
+    n = k.x
+    mask = (1 << G_WINDOW) - 1
+    result = I
+    for row in g_table():
+        if not n:
+            break
+        digit = n & mask
+        if digit:
+            result = result + row[digit - 1]
+        n >>= G_WINDOW
+    return result
+
+
+if profiling is not None:
+    profiling.register(Fp, 'inv', 'secp256k1.inversion', profiling.COUNTER)
+    profiling.register(Pt, '__mul__', 'secp256k1.scalar_mul')
+    profiling.register(sys.modules[__name__], 'mul_g', 'secp256k1.mul_g')
+
 if __name__ == '__main__':
     p = G * Fr(42)
     q = G * Fr(24)
@@ -185,3 +467,9 @@ if __name__ == '__main__':
 
     x = Fq(0x660fe3dd941bc58104fff3b424d82cd69658191f91166af80528e65d07cec0c0)
     assert x.sqrt() * x.sqrt() == x
+
+    assert Pt.decode(p.encode()) == p
+    assert Pt.decode((-p).encode()) == -p
+    assert Pt.decode(p.encode(compressed=False)) == p
+    assert Pt.decode(I.encode()) == I
+    assert decode_points([p.encode(), q.encode(), p.encode()]) == [p, q, p]
@@ -1,5 +1,5 @@
 import random
-from spear_ptlc.node import Node, SecretKey
+from spear_ptlc.node import Node, verify_proof
 
 def run_test():
     print("Running Spear PTLC protocol test...")
@@ -14,7 +14,7 @@ def run_test():
     # 1. Payee creates invoice
     amount = 100
     payment_hash, pubkey, _ = payee.new_invoice(amount)
-    print(f"Payee created invoice with payment hash: {payment_hash}")
+    print(f"Payee created invoice with payment hash: {payment_hash.hex()}")
     
     # 2. Payer pays invoice
     parts_count = 5
@@ -52,25 +52,13 @@ def run_test():
     print("Payment successfully claimed by payee")
 
     # 7. Payer can extract payment proof from claim
-    payment = payer.find_payment(payment_hash)
-    payment_proof = None
-    for index, claim_secret in enumerate(claim_secrets):
-        ptlc = received_ptlcs[index]
-        payer_hop_secret = payment.hop_secrets[ptlc.id]
-        secret = claim_secret - payer_hop_secret
-        if payment_proof is None:
-            payment_proof = secret
-        if payment_proof != secret:
-            raise Exception("Payment proof is not consistent")
-            
+    payment_proof = payer.extract_payment_proof(payment_hash, claim_secrets)
     print(f"Payment proof: {payment_proof}")
 
     # 8. Anyone with invoice pubkey can verify payment proof
     invoice = payee.find_invoice(payment_hash)
-    pubkey = SecretKey(payment_proof).pubkey()
-    print(f"Payment proof pubkey: {pubkey.pubkey}")
     print(f"Invoice pubkey: {invoice.pubkey.pubkey}")
-    if pubkey.pubkey == invoice.pubkey.pubkey:
+    if verify_proof(invoice.pubkey, payment_proof):
         print("Payment proof is verified")
     else:
         raise Exception("Payment proof is not verified")